@@ -1,20 +1,61 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse, JSONResponse, ORJSONResponse
 from pydantic import BaseModel
-import os, json, asyncio, uuid, re
-from typing import Optional, Dict, Any
+import os, json, asyncio, uuid, re, functools, hashlib, random, webbrowser
+from contextlib import asynccontextmanager, aclosing
+from typing import Optional, Dict, Any, Callable
 from mcp.client.stdio import stdio_client, StdioServerParameters
 from mcp.client.session import ClientSession
-from openai import OpenAI
+import openai
+import pytz
+from datetime import datetime
+from openai import AsyncOpenAI
+import httpx
+from cachetools import LRUCache, TTLCache
 import server as mcp_tools
 from fastapi.responses import RedirectResponse
 
+# orjson is optional: it speeds up tool-result marshalling when installed, stdlib json otherwise
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _json_loads(raw: str | bytes) -> Any:
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+def _json_dumps(obj: Any, sort_keys: bool = False) -> str:
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0).decode("utf-8")
+    return json.dumps(obj, sort_keys=sort_keys)
+
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
 SERVER_PATH = os.path.join(PROJECT_ROOT, "server.py")
 
-app = FastAPI(title="Medbridge AI API")
+# Set by main() when the chat UI should be opened once the server is accepting requests
+BROWSER_URL: Optional[str] = None
+
+async def _open_browser_later(url: str) -> None:
+    await asyncio.sleep(1.0)
+    try:
+        webbrowser.open(url)
+    except Exception:
+        pass
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    opener = asyncio.create_task(_open_browser_later(BROWSER_URL)) if BROWSER_URL else None
+    yield
+    if opener is not None:
+        opener.cancel()
+    if ASYNC_CLIENT is not None:
+        await ASYNC_CLIENT.close()
+    if REDIS is not None:
+        await REDIS.aclose()
+
+app = FastAPI(title="Medbridge AI API", lifespan=lifespan, default_response_class=ORJSONResponse if orjson else JSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -32,6 +73,70 @@ async def root_redirect():
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+# Single shared async client; None when the key is missing (routes report that as a 500).
+# Its httpx pool is sized for concurrent chats so keep-alive connections are reused across requests.
+ASYNC_CLIENT = AsyncOpenAI(
+    api_key=OPENAI_API_KEY,
+    # Retries happen in _with_retries, which honours Retry-After; SDK retries would multiply them
+    max_retries=0,
+    http_client=httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "256")),
+            max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE", "128")),
+        ),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    ),
+) if OPENAI_API_KEY else None
+
+# Caps in-flight completion requests across all sessions; tune to the account's rate limits
+_OPENAI_SEMAPHORE = asyncio.Semaphore(int(os.getenv("OPENAI_MAX_CONCURRENCY", "32")))
+
+# Transient failures worth another attempt; anything else is a caller error and propagates at once
+_RETRYABLE_OPENAI_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+_OPENAI_ATTEMPTS = 3
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """Wait before retrying: the server's Retry-After on a 429, else jittered exponential backoff; never over 30s."""
+    if isinstance(error, openai.RateLimitError) and error.response is not None:
+        try:
+            return max(0.0, min(30.0, float(error.response.headers.get("retry-after"))))
+        except (TypeError, ValueError):
+            pass
+    return min(30.0, 2 ** attempt) * random.uniform(0.5, 1.0)
+
+async def _with_retries(call: Callable, *args, attempts: int = _OPENAI_ATTEMPTS, **kwargs):
+    """Await call(*args, **kwargs), retrying transient OpenAI errors up to `attempts` times in total."""
+    for attempt in range(1, attempts + 1):
+        try:
+            return await call(*args, **kwargs)
+        except _RETRYABLE_OPENAI_ERRORS as e:
+            if attempt >= attempts:
+                raise
+            await asyncio.sleep(_retry_delay(e, attempt))
+
+async def _create_chat_completion(**kwargs):
+    # The permit covers one request only, so it is never held while backing off
+    async with _OPENAI_SEMAPHORE:
+        return await ASYNC_CLIENT.chat.completions.create(**kwargs)
+
+async def _chat_completion(*, attempts: int = _OPENAI_ATTEMPTS, **kwargs):
+    """chat.completions.create behind the shared concurrency cap, retried on 429s and other transient errors."""
+    return await _with_retries(_create_chat_completion, attempts=attempts, **kwargs)
+
+async def _stream_chat_completion(**kwargs):
+    """Streamed chat.completions.create; the concurrency permit is held until the stream is consumed or closed."""
+    async with _OPENAI_SEMAPHORE:
+        stream = await ASYNC_CLIENT.chat.completions.create(stream=True, **kwargs)
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.close()
 
 SYSTEM_PROMPT = """You are Medbridge AI, a bilingual triage & booking assistant supporting English and Roman Urdu only.
 
@@ -138,40 +243,116 @@ _ROMAN_URDU_MAP = {
     "daane": "skin_rash",
 }
 
+# Longest keys first so "skin issue" wins over "skin"; only the left edge is anchored so plurals still match
+_NORM_RE = re.compile(r"\b(" + "|".join(map(re.escape, sorted(_ROMAN_URDU_MAP, key=len, reverse=True))) + ")")
+
 def _normalization_hint(text: str) -> str | None:
-    t = (text or "").lower()
-    hits = []
-    for k, v in _ROMAN_URDU_MAP.items():
-        if k in t:
-            hits.append(f"{k}→{v}")
+    hits = {f"{k}→{_ROMAN_URDU_MAP[k]}" for k in _NORM_RE.findall((text or "").lower())}
     if hits:
-        return "Normalization hint: interpret roman-Urdu tokens as → " + ", ".join(sorted(set(hits)))
+        return "Normalization hint: interpret roman-Urdu tokens as → " + ", ".join(sorted(hits))
     return None
 
+# Words that can make the intent classifier return something; anything else skips the LLM call.
+# Matched as whole words so "spain" or "kitchen" don't trigger, hence the explicit inflections.
+_MEDICAL_TRIGGERS = frozenset(_ROMAN_URDU_MAP) | frozenset({
+    "fever", "fevers", "temperature", "flu", "cold", "colds", "cough", "coughing",
+    "pain", "pains", "painful", "ache", "aches", "aching", "hurt", "hurts", "hurting",
+    "sick", "symptom", "symptoms",
+    "doctor", "doctors", "physician", "specialist", "general", "family", "primary", "checkup",
+    "skin", "rash", "itchy", "acne", "pimple", "pimples", "eczema", "psoriasis",
+    "eye", "eyes", "vision", "sight", "blur", "blurry", "blurred",
+    "ophthalmology", "ophthalmologist", "headaches", "migraines",
+})
+_MEDICAL_TRIGGER_RE = re.compile(r"\b(?:" + "|".join(map(re.escape, sorted(_MEDICAL_TRIGGERS, key=len, reverse=True))) + r")\b")
+
+# Short replies such as "yes", "confirm", "go ahead" or "theek hai" need neither translation nor intent
+_CONFIRMATION_WORDS = frozenset({
+    "yes", "yeah", "yep", "ok", "okay", "sure", "confirm", "confirmed", "book", "go", "ahead",
+    "please", "thanks", "thank",
+    "haan", "han", "ji", "jee", "theek", "thik", "hai", "shukriya",
+})
+
+def _is_confirmation(text: str) -> bool:
+    tokens = re.findall(r"[a-z']+", (text or "").lower())
+    return 0 < len(tokens) <= 3 and all(t in _CONFIRMATION_WORDS for t in tokens)
+
+def _mentions_medical_terms(text: str) -> bool:
+    return _MEDICAL_TRIGGER_RE.search((text or "").lower()) is not None
+
+# Roman Urdu markers: symptom stems match as word prefixes, short particles only as whole words
+_ROMAN_URDU_STEMS = (
+    "bukhar", "sar dard", "sirdard", "zukam", "jukam", "khansi",
+    "ankh", "aankh", "ankhon", "derma", "kharish", "khaarish",
+    "khujli", "jild", "daane",
+)
+_ROMAN_URDU_PARTICLES = (
+    "hai", "hain", "ka", "ki", "ke", "mein", "ko", "se", "par", "tak", "bhi", "ya", "aur",
+)
+_ROMAN_URDU_RE = re.compile(
+    r"\b(?:" + "|".join(map(re.escape, _ROMAN_URDU_STEMS)) + r")"
+    r"|\b(?:" + "|".join(map(re.escape, _ROMAN_URDU_PARTICLES)) + r")\b"
+)
+
+@functools.lru_cache(maxsize=2048)
 def _detect_language(text: str) -> str:
     """
     Detect if text is in Roman Urdu or English.
     Returns 'urdu' for Roman Urdu, 'english' for English.
     """
-    # Check for Roman Urdu patterns
-    roman_urdu_indicators = [
-        "bukhar", "sar dard", "sirdard", "zukam", "jukam", "khansi", 
-        "ankh", "aankh", "ankhon", "derma", "kharish", "khaarish", 
-        "khujli", "jild", "daane", "hai", "hain", "ka", "ki", "ke", 
-        "mein", "ko", "se", "par", "tak", "bhi", "ya", "aur"
-    ]
-    
-    text_lower = text.lower()
-    urdu_count = sum(1 for indicator in roman_urdu_indicators if indicator in text_lower)
-    
-    # If we find Roman Urdu indicators, classify as Urdu
-    if urdu_count > 0:
+    # A single Roman Urdu marker is enough to classify as Urdu
+    if _ROMAN_URDU_RE.search(text.lower()):
         return "urdu"
     
     # Default to English
     return "english"
 
-def _translate_to_english(text: str) -> Dict[str, str]:
+# Word-level Roman Urdu -> English glossary for the local translation fast path
+_ROMAN_URDU_GLOSSARY = {
+    "bukhar": "fever", "sirdard": "headache", "sar": "head", "dard": "pain",
+    "zukam": "flu", "jukam": "flu", "khansi": "cough",
+    "ankh": "eye", "aankh": "eye", "ankhon": "eyes", "nazar": "vision",
+    "jild": "skin", "kharish": "itching", "khaarish": "itching", "khujli": "itching", "daane": "rash",
+    "mujhe": "I have", "mujhay": "I have", "mera": "my", "meri": "my", "mere": "my", "naam": "name",
+    "hai": "is", "hain": "are", "ka": "of", "ki": "of", "ke": "of", "mein": "in", "ko": "to",
+    "se": "from", "par": "on", "tak": "until", "bhi": "also", "ya": "or", "aur": "and",
+    "aaj": "today", "kal": "tomorrow", "parson": "day after tomorrow", "subah": "morning", "shaam": "evening",
+    "chahiye": "need", "chahye": "need", "dikhana": "to see", "milna": "to meet", "karni": "to make",
+    "karna": "to do", "kya": "what", "kab": "when", "koi": "any", "wala": "", "wali": "",
+    "haan": "yes", "han": "yes", "ji": "yes", "nahi": "no", "nahin": "no", "theek": "okay", "thik": "okay",
+    "shukriya": "thanks",
+}
+# Tokens that are already English in this domain and pass through unchanged
+_ENGLISH_PASSTHROUGH = _MEDICAL_TRIGGERS | {
+    "dr", "appointment", "book", "booking", "slot", "slots", "available", "availability",
+    "online", "inperson", "cancel", "reschedule", "eric", "diego", "ali",
+    "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday",
+    "am", "pm", "next", "week", "today", "tomorrow",
+}
+# Share of tokens the glossary must cover before the LLM translation is skipped
+_LOCAL_TRANSLATION_MIN_COVERAGE = 0.8
+
+def _translate_locally(text: str) -> tuple[str, float]:
+    """Gloss Roman Urdu word by word; returns the English text and the share of tokens recognized."""
+    tokens = re.findall(r"[a-z0-9:']+", text.lower())
+    if not tokens:
+        return text, 0.0
+    mapped, known = [], 0
+    for tok in tokens:
+        if tok in _ROMAN_URDU_GLOSSARY:
+            known += 1
+            if _ROMAN_URDU_GLOSSARY[tok]:
+                mapped.append(_ROMAN_URDU_GLOSSARY[tok])
+        else:
+            if tok in _ENGLISH_PASSTHROUGH or tok[0].isdigit():
+                known += 1
+            mapped.append(tok)
+    return " ".join(mapped), known / len(tokens)
+
+# Successful LLM results keyed by normalized input; short phrases repeat heavily across users
+_TRANSLATION_CACHE: LRUCache = LRUCache(maxsize=4096)
+_CONDITION_CACHE: LRUCache = LRUCache(maxsize=4096)
+
+async def _translate_to_english(text: str) -> Dict[str, str]:
     """
     Translate Roman Urdu to English, or keep English as is.
     Only supports English and Roman Urdu - other languages are not supported.
@@ -181,10 +362,19 @@ def _translate_to_english(text: str) -> Dict[str, str]:
     if detected_lang == "english":
         return {"lang": "english", "english": text}
     
+    # Short symptom/scheduling phrases are covered by the glossary; no LLM round-trip needed
+    english, coverage = _translate_locally(text)
+    if coverage >= _LOCAL_TRANSLATION_MIN_COVERAGE:
+        return {"lang": "urdu", "english": english}
+    
+    key = text.strip().lower()
+    cached = _TRANSLATION_CACHE.get(key)
+    if cached is not None:
+        return dict(cached)
+    
     # For Roman Urdu, try to translate to English
     try:
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        resp = client.chat.completions.create(
+        resp = await _chat_completion(
             model=OPENAI_MODEL,
             temperature=0.0,
             messages=[
@@ -195,20 +385,24 @@ def _translate_to_english(text: str) -> Dict[str, str]:
         raw = resp.choices[0].message.content or ""
         data = json.loads(raw)
         if isinstance(data, dict) and data.get("english"):
-            return {"lang": str(data.get("lang") or "urdu"), "english": str(data.get("english"))}
+            result = {"lang": str(data.get("lang") or "urdu"), "english": str(data.get("english"))}
+            _TRANSLATION_CACHE[key] = result
+            return dict(result)
     except Exception:
         pass
     
     # Fallback: treat as English
     return {"lang": "english", "english": text}
 
-def _classify_intent_condition(text: str) -> str | None:
+async def _classify_intent_condition(text: str) -> str | None:
     """
     Use the LLM to map user text to medical conditions or doctor types.
     Returns the condition string or None.
     """
+    key = text.strip().lower()
+    if key in _CONDITION_CACHE:
+        return _CONDITION_CACHE[key]
     try:
-        client = OpenAI(api_key=OPENAI_API_KEY)
         prompt = (
             "Classify the user's health concern or doctor request into one of these categories:\n"
             "GENERAL CONDITIONS: fever, headache, flu, general, family_doctor, primary_care\n"
@@ -226,7 +420,7 @@ def _classify_intent_condition(text: str) -> str | None:
             "\n"
             "If none applies, return none. Reply strictly as JSON: {\"condition\": \"<one_of_above_or_none>\"}."
         )
-        resp = client.chat.completions.create(
+        resp = await _chat_completion(
             model=OPENAI_MODEL,
             temperature=0.0,
             messages=[
@@ -237,6 +431,8 @@ def _classify_intent_condition(text: str) -> str | None:
         raw = resp.choices[0].message.content or ""
         data = json.loads(raw)
         cond = (data or {}).get("condition")
+        # A well-formed answer is cached even when it is "none"; transport errors are not
+        _CONDITION_CACHE[key] = None
         if isinstance(cond, str):
             cond = cond.strip().lower()
             # Check if it's a valid condition
@@ -248,6 +444,7 @@ def _classify_intent_condition(text: str) -> str | None:
                 "family_doctor", "primary_care"
             }
             if cond in valid_conditions:
+                _CONDITION_CACHE[key] = cond
                 return cond
     except Exception:
         pass
@@ -274,33 +471,46 @@ def _detect_general_doctor_query(text: str) -> bool:
     ]
     return any(query in text_lower for query in general_queries)
 
+def _directory_name_tokens() -> tuple[str, ...]:
+    """Lower-case name tokens of every doctor server.list_doctors() returns."""
+    tokens: list[str] = []
+    for d in mcp_tools.list_doctors():
+        for tok in re.findall(r"[a-z]+", str(d.get("name") or "").lower()):
+            if tok not in ("dr", "doctor") and tok not in tokens:
+                tokens.append(tok)
+    return tuple(tokens)
+
+# Known doctors are checked first (one alternation scan); the generic patterns only run on a miss.
+# The pattern is rebuilt only when server.py reports a directory reload, not on every request.
+_KNOWN_DOCTOR_STATE: Dict[str, Any] = {"generation": None, "re": None}
+
+def _known_doctor_re() -> re.Pattern:
+    generation = mcp_tools.directory_generation()
+    if generation != _KNOWN_DOCTOR_STATE["generation"]:
+        names = _directory_name_tokens() or ("eric", "diego", "ali")
+        _KNOWN_DOCTOR_STATE["re"] = re.compile(r"\b(" + "|".join(map(re.escape, names)) + r")\b")
+        _KNOWN_DOCTOR_STATE["generation"] = generation
+    return _KNOWN_DOCTOR_STATE["re"]
+
+_DOCTOR_NAME_PATTERNS = (
+    re.compile(r"dr\.?\s+(\w+)"),
+    re.compile(r"doctor\s+(\w+)"),
+    re.compile(r"(\w+)\s+doctor"),
+)
+
 def _detect_doctor_name(text: str) -> str | None:
     """
     Detect if user is asking about a specific doctor by name.
     Returns doctor name if found, None otherwise.
     """
-    # Check for known doctor names from the database
-    known_doctors = ["Dr. Eric", "Dr. Diego", "Dr. Ali", "Eric", "Diego", "Ali"]
-    
     text_lower = text.lower()
-    for doctor in known_doctors:
-        if doctor.lower() in text_lower:
-            # Return the proper name format
-            if doctor.startswith("Dr."):
-                return doctor
-            else:
-                return f"Dr. {doctor}"
+    known = _known_doctor_re().search(text_lower)
+    if known:
+        return f"Dr. {known.group(1).title()}"
     
     # Check for general doctor patterns
-    import re
-    patterns = [
-        r"dr\.?\s+(\w+)",
-        r"doctor\s+(\w+)",
-        r"(\w+)\s+doctor"
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, text_lower)
+    for pattern in _DOCTOR_NAME_PATTERNS:
+        match = pattern.search(text_lower)
         if match:
             name = match.group(1).title()
             return f"Dr. {name}"
@@ -331,17 +541,22 @@ def _build_session_hint(state: Dict[str, Any]) -> str:
         "When helpful, begin your reply with a one-line recap of the plan before proceeding."
     )
 
+_CLINIC_TZ = pytz.timezone("Asia/Karachi")
+
 def _get_current_date_context() -> str:
     """Get current date context for the system prompt."""
     try:
-        import pytz
-        from datetime import datetime
-        tz = pytz.timezone("Asia/Karachi")
-        now = datetime.now(tz)
+        now = datetime.now(_CLINIC_TZ)
         return f"Current date: {now.strftime('%A, %B %d, %Y')} ({now.strftime('%Y-%m-%d')})\nCurrent time: {now.strftime('%H:%M:%S')} ({now.tzinfo})\nToday is {now.strftime('%A')} (weekday index: {now.weekday()})"
     except Exception as e:
         return f"Current date: Unable to get date ({str(e)})"
 
+# Messy format: "**Tuesday, September 09** - 11:00 - 11:30 - 12:00..."
+_MESSY_SLOTS_RE = re.compile(r'\*\*([^*]+?)\*\*\s*-\s*([^*-]+?)(?=\*\*|$)')
+# Inline format: "Date: Tuesday, September 09 - 11:00 - 11:30..."
+_DATE_SLOTS_RE = re.compile(r'Date:\s*([^-\n]+?)\s*-\s*([^D]+?)(?=Date:|$)')
+_TIME_SLOT_RE = re.compile(r'\d{1,2}:\d{2}')
+
 def _force_proper_formatting(content: str) -> str:
     """
     Force proper formatting for availability information regardless of AI output.
@@ -349,46 +564,31 @@ def _force_proper_formatting(content: str) -> str:
     """
     if not content:
         return content
-    
-    # Pattern to match the messy format: "**Tuesday, September 09** - 11:00 - 11:30 - 12:00..."
-    messy_pattern = r'\*\*([^*]+?)\*\*\s*-\s*([^*-]+?)(?=\*\*|$)'
+    # Both patterns need a literal marker, so most replies can skip the regex passes
+    if "**" not in content and "Date:" not in content:
+        return content
     
     def replace_messy_format(match):
         date_part = match.group(1).strip()
         time_part = match.group(2).strip()
         
-        # Extract individual time slots
-        time_slots = re.findall(r'\d{1,2}:\d{2}', time_part)
-        
-        # Build properly formatted result
-        result = f"{date_part}\n"
-        for time_slot in time_slots:
-            result += f"- {time_slot}\n"
-        
-        return result
+        # One bullet line per time slot, built in a single join
+        slots = "".join(f"- {m.group()}\n" for m in _TIME_SLOT_RE.finditer(time_part))
+        return f"{date_part}\n{slots}"
     
     # Apply the formatting fix
-    formatted_content = re.sub(messy_pattern, replace_messy_format, content)
+    formatted_content = _MESSY_SLOTS_RE.sub(replace_messy_format, content)
     
     # Also handle cases where there might be multiple dates in sequence
-    # Look for patterns like "Date: Tuesday, September 09 - 11:00 - 11:30..."
-    date_pattern = r'Date:\s*([^-\n]+?)\s*-\s*([^D]+?)(?=Date:|$)'
-    
     def replace_date_format(match):
         date_part = match.group(1).strip()
         time_part = match.group(2).strip()
         
-        # Extract individual time slots
-        time_slots = re.findall(r'\d{1,2}:\d{2}', time_part)
-        
-        # Build properly formatted result
-        result = f"{date_part}\n"
-        for time_slot in time_slots:
-            result += f"- {time_slot}\n"
-        
-        return result
+        # One bullet line per time slot, built in a single join
+        slots = "".join(f"- {m.group()}\n" for m in _TIME_SLOT_RE.finditer(time_part))
+        return f"{date_part}\n{slots}"
     
-    formatted_content = re.sub(date_pattern, replace_date_format, formatted_content)
+    formatted_content = _DATE_SLOTS_RE.sub(replace_date_format, formatted_content)
     
     return formatted_content
 
@@ -518,28 +718,122 @@ FUNCTIONS = [
     }
 ]
 
-SESSIONS: Dict[str, Dict[str, Any]] = {}
-
-# In-process tool map
-TOOL_MAP = {
-    "doctor_lookup": mcp_tools.doctor_lookup,
-    "availability_tool": mcp_tools.availability_tool,
-    "appointment_book_tool": mcp_tools.appointment_book_tool,
-    "list_appointments_tool": mcp_tools.list_appointments_tool,
-    "cancel_appointment_tool": mcp_tools.cancel_appointment_tool,
-    "reschedule_tool": mcp_tools.reschedule_tool,
-    "doctor_lookup_by_name": mcp_tools.doctor_lookup_by_name,
-    "doctor_weekly_availability": mcp_tools.doctor_weekly_availability,
-    "list_doctors": mcp_tools.list_doctors,
-    "now_tool": mcp_tools.now_tool,
+# Built once and frozen; passed unchanged to every completion call
+TOOLS_PAYLOAD = tuple({"type": "function", "function": f} for f in FUNCTIONS)
+
+# Least-recently-used sessions are evicted once the store is full
+SESSIONS: LRUCache = LRUCache(maxsize=int(os.getenv("MAX_SESSIONS", "10000")))
+# At least one, since history[:-0] is an empty slice and would never trim anything
+MAX_HISTORY_MESSAGES = max(1, int(os.getenv("MAX_HISTORY_MESSAGES", "20")))
+
+# Optional shared session store: with REDIS_URL set and redis installed, sessions survive restarts
+# and are shared by every worker; otherwise they live in SESSIONS above.
+REDIS_URL = os.getenv("REDIS_URL")
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "3600"))
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+REDIS = aioredis.from_url(REDIS_URL) if REDIS_URL and aioredis else None
+
+async def _load_session(session_id: str) -> Dict[str, Any]:
+    if REDIS is None:
+        return SESSIONS.setdefault(session_id, {"history": []})
+    raw = await REDIS.get(f"sess:{session_id}")
+    session = _json_loads(raw) if raw else {}
+    session.setdefault("history", [])
+    return session
+
+async def _save_session(session_id: str, session: Dict[str, Any]) -> None:
+    # In-process sessions are mutated in place and need no write-back
+    if REDIS is not None:
+        await REDIS.set(f"sess:{session_id}", _json_dumps(session), ex=SESSION_TTL_SECONDS)
+
+# Shared by identity across every prompt; never mutate it
+SYSTEM_MSG = {"role": "system", "content": SYSTEM_PROMPT}
+
+def _build_prompt(history: list[dict], turn: list[dict]) -> list[dict]:
+    """Messages for one completion: system prompt, stored dialogue, date context, this turn's hints and user message."""
+    date_msg = {"role": "system", "content": _get_current_date_context()}
+    return [SYSTEM_MSG, *history, date_msg, *turn]
+
+def _trim_history(history: list[dict]) -> None:
+    """Keep the last MAX_HISTORY_MESSAGES entries in place, never starting on an orphaned tool reply."""
+    del history[:-MAX_HISTORY_MESSAGES]
+    # A tool reply is only valid right after the assistant message that requested it
+    while history and history[0].get("role") == "tool":
+        del history[0]
+
+# Final assistant replies for turns that needed no tools, keyed by _response_cache_key
+RESPONSE_CACHE: TTLCache = TTLCache(maxsize=4096, ttl=300)
+_TIME_SENSITIVE_RE = re.compile(r"\b(today|now|abhi|aaj)\b")
+
+def _response_cache_key(history: list[dict], turn: list[dict]) -> str | None:
+    """
+    Hash the model, clinic date, recent dialogue and this turn's prompt messages.
+    Returns None when the user refers to the current time, which must never be served from cache.
+    """
+    user_text = str(turn[-1].get("content") or "").lower()
+    if _TIME_SENSITIVE_RE.search(user_text):
+        return None
+    dialogue = [m for m in history if m.get("role") in ("user", "assistant") and m.get("content")][-4:]
+    material = _json_dumps([OPENAI_MODEL, mcp_tools.now_tool()["date"], dialogue, turn], sort_keys=True)
+    return hashlib.blake2b(material.encode("utf-8"), digest_size=16).hexdigest()
+
+# In-process tool map: name -> (function, blocking). Blocking tools hit Google Calendar or SMTP
+# and run in a worker thread; the directory lookups are plain dict scans and run inline.
+TOOL_MAP: Dict[str, tuple[Callable[..., Any], bool]] = {
+    "doctor_lookup": (mcp_tools.doctor_lookup, False),
+    "availability_tool": (mcp_tools.availability_tool, True),
+    "appointment_book_tool": (mcp_tools.appointment_book_tool, True),
+    "list_appointments_tool": (mcp_tools.list_appointments_tool, True),
+    "cancel_appointment_tool": (mcp_tools.cancel_appointment_tool, True),
+    "reschedule_tool": (mcp_tools.reschedule_tool, True),
+    "doctor_lookup_by_name": (mcp_tools.doctor_lookup_by_name, False),
+    "doctor_weekly_availability": (mcp_tools.doctor_weekly_availability, True),
+    "list_doctors": (mcp_tools.list_doctors, False),
+    "now_tool": (mcp_tools.now_tool, False),
 }
 
+# Tools that change calendar state; a turn containing any of these keeps its calls in order
+_MUTATING_TOOLS = {"appointment_book_tool", "cancel_appointment_tool", "reschedule_tool"}
+# Calendar reads repeat heavily within a conversation; results are reused briefly and
+# dropped whenever a mutating tool runs, so a fresh booking is never hidden
+_CALENDAR_READ_TOOLS = {"availability_tool", "doctor_weekly_availability", "list_appointments_tool"}
+TOOL_RESULT_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=int(os.getenv("TOOL_CACHE_TTL_SECONDS", "30")))
+# Bumped by every mutating call; a read that overlapped a mutation must not be cached
+_CACHE_GENERATION = [0]
+
 async def mcp_call(tool_name: str, args: dict):
-    func = TOOL_MAP.get(tool_name)
-    if func:
+    if tool_name in _MUTATING_TOOLS:
+        _CACHE_GENERATION[0] += 1
+        TOOL_RESULT_CACHE.clear()
         try:
-            # Run the sync tool in a thread to avoid blocking the event loop
-            return await asyncio.to_thread(func, **args)
+            return await _call_tool(tool_name, args)
+        finally:
+            _CACHE_GENERATION[0] += 1
+            TOOL_RESULT_CACHE.clear()
+    if tool_name not in _CALENDAR_READ_TOOLS:
+        return await _call_tool(tool_name, args)
+    key = (tool_name, _json_dumps(args, sort_keys=True))
+    cached = TOOL_RESULT_CACHE.get(key)
+    if cached is not None:
+        return cached
+    generation = _CACHE_GENERATION[0]
+    result = await _call_tool(tool_name, args)
+    if generation == _CACHE_GENERATION[0] and not (isinstance(result, dict) and "error" in result):
+        TOOL_RESULT_CACHE[key] = result
+    return result
+
+async def _call_tool(tool_name: str, args: dict):
+    entry = TOOL_MAP.get(tool_name)
+    if entry:
+        func, blocking = entry
+        try:
+            if blocking:
+                # Run the sync tool in a thread to avoid blocking the event loop
+                return await asyncio.to_thread(func, **args)
+            return func(**args)
         except Exception as e:
             # Fall back to stdio approach if direct call fails for any reason
             pass
@@ -558,144 +852,198 @@ async def mcp_call(tool_name: str, args: dict):
                     for c in res.content:
                         if getattr(c, "text", None):
                             try:
-                                items.append(json.loads(c.text))
+                                items.append(_json_loads(c.text))
                             except Exception:
                                 items.append({"raw_text": c.text})
                 payload = items[0] if len(items) == 1 else (items or {"ok": True})
             return payload
 
+async def _run_one_tool(fn: str, arguments: str | None) -> Any:
+    try:
+        raw_args = _json_loads(arguments or "{}")
+    except Exception:
+        raw_args = {}
+    try:
+        return await mcp_call(fn, raw_args)
+    except Exception as e:
+        return {"error": str(e)}
+
+async def _run_tool_calls(calls: list[tuple[str, str, str | None]], session: Dict[str, Any]) -> list[dict]:
+    """
+    Execute one assistant turn's tool calls and return the matching tool messages in call order.
+    Read-only calls run concurrently; turns that book, cancel or reschedule run sequentially.
+    """
+    if any(fn in _MUTATING_TOOLS for _, fn, _ in calls):
+        results = [await _run_one_tool(fn, arguments) for _, fn, arguments in calls]
+    else:
+        results = await asyncio.gather(*(_run_one_tool(fn, arguments) for _, fn, arguments in calls))
+
+    tool_messages = []
+    for (call_id, fn, _), result_json in zip(calls, results):
+        # Update session state based on tool results
+        if fn == "doctor_lookup" and isinstance(result_json, dict):
+            doctors = result_json.get("result", [])
+            if isinstance(doctors, list):
+                session["last_doctor_options"] = doctors
+        elif fn == "availability_tool" and isinstance(result_json, dict):
+            avail_data = result_json.get("result", {})
+            if isinstance(avail_data, dict):
+                session["last_availability"] = {
+                    "doctor_name": avail_data.get("doctor_name"),
+                    "date": avail_data.get("date"),
+                    "slots": avail_data.get("slots", [])
+                }
+        tool_messages.append({
+            "role": "tool",
+            "tool_call_id": call_id,
+            "name": fn,
+            "content": _json_dumps(result_json)
+        })
+    return tool_messages
+
 class ChatIn(BaseModel):
     session_id: Optional[str] = None
     user: str
     language: Optional[str] = "en"
 
-@app.post("/chat")
-async def chat(body: ChatIn):
-    if not OPENAI_API_KEY:
-        raise HTTPException(status_code=500, detail="OPENAI_API_KEY missing")
-    
+async def _prepare_turn(body: ChatIn) -> tuple[str, Dict[str, Any], list[dict]]:
+    """
+    Shared prologue of /chat and /chat/stream: fetch the session, run the local detectors and
+    the translation/intent helpers, and build this turn's hints.
+    Returns (session_id, session, turn) where turn is the hint messages followed by the user message.
+    """
     session_id = body.session_id or str(uuid.uuid4())
-    session = SESSIONS.setdefault(session_id, {"messages": [{"role": "system", "content": SYSTEM_PROMPT}]})
-    messages = session["messages"]
-
-    # Inject current date context
-    date_context = _get_current_date_context()
-    messages.append({"role": "system", "content": date_context})
+    session = await _load_session(session_id)
+    # Per-turn system hints: rebuilt on every turn and never stored in the session
+    hints: list[dict] = []
 
     # Inject normalization hint if roman Urdu tokens detected
     hint = _normalization_hint(body.user)
     if hint:
-        messages.append({"role": "system", "content": hint})
+        hints.append({"role": "system", "content": hint})
 
     # Session memory hint - maintain conversation context
     session_hint = _build_session_hint(session)
-    messages.append({"role": "system", "content": session_hint})
+    hints.append({"role": "system", "content": session_hint})
     
-    # Translate user message to English and inject hint
-    translated_user_message = _translate_to_english(body.user)
-    messages.append({"role": "system", "content": f"User message in {translated_user_message['lang']}: {body.user}\nEnglish translation: {translated_user_message['english']}"})
+    # Translate user message to English and inject hint (confirmations keep the session language)
+    if _is_confirmation(body.user):
+        translated_user_message = {"lang": session.get("lang") or "english", "english": body.user}
+    else:
+        translated_user_message = await _translate_to_english(body.user)
+    if translated_user_message['english'] != body.user:
+        hints.append({"role": "system", "content": f"User message in {translated_user_message['lang']}: {body.user}\nEnglish translation: {translated_user_message['english']}"})
+    # Intent classification runs in the background while the local detectors below do their work
+    intent_task = None
+    if _mentions_medical_terms(translated_user_message['english']):
+        intent_task = asyncio.create_task(_classify_intent_condition(translated_user_message['english']))
+    is_general_query = _detect_general_doctor_query(translated_user_message['english'])
+    detected_doctor = _detect_doctor_name(translated_user_message['english'])
     # Intent classification hint
-    _intent = _classify_intent_condition(translated_user_message['english'])
+    _intent = await intent_task if intent_task else None
     if _intent:
-        messages.append({"role": "system", "content": f"Intent condition: {_intent}. If symptoms are present, call doctor_lookup with condition='{_intent}'. When showing results, ALWAYS display as 'Dr. [Name] - [Specialization]' format."})
+        hints.append({"role": "system", "content": f"Intent condition: {_intent}. If symptoms are present, call doctor_lookup with condition='{_intent}'. When showing results, ALWAYS display as 'Dr. [Name] - [Specialization]' format."})
         # Update session with detected condition
         session["last_condition"] = _intent
     # Update session with language
     session["lang"] = translated_user_message['lang']
     
     # General doctor availability detection
-    if _detect_general_doctor_query(translated_user_message['english']):
-        messages.append({"role": "system", "content": "User is asking about general doctor availability. Call list_doctors to show all available doctors. MANDATORY: Display each doctor as 'Dr. [Name] - [Specialization]' with their experience, fees, and schedule. Example: 'Dr. Eric - Ophthalmology (7 years, PKR 2500 online)'"})
+    if is_general_query:
+        hints.append({"role": "system", "content": "User is asking about general doctor availability. Call list_doctors to show all available doctors. MANDATORY: Display each doctor as 'Dr. [Name] - [Specialization]' with their experience, fees, and schedule. Example: 'Dr. Eric - Ophthalmology (7 years, PKR 2500 online)'"})
         session["last_query_type"] = "general_doctors"
     
     # Doctor name detection
-    detected_doctor = _detect_doctor_name(translated_user_message['english'])
     if detected_doctor:
-        messages.append({"role": "system", "content": f"User asking about specific doctor: {detected_doctor}. Call doctor_lookup_by_name with doctor_name='{detected_doctor}' to find the doctor, then doctor_weekly_availability to show their schedule for next 7 days. When displaying doctor info, ALWAYS show as 'Dr. [Name] - [Specialization]' format."})
+        hints.append({"role": "system", "content": f"User asking about specific doctor: {detected_doctor}. Call doctor_lookup_by_name with doctor_name='{detected_doctor}' to find the doctor, then doctor_weekly_availability to show their schedule for next 7 days. When displaying doctor info, ALWAYS show as 'Dr. [Name] - [Specialization]' format."})
         session["last_doctor_query"] = detected_doctor
     
     
     # Reply language hint - RESTRICTED TO ENGLISH AND ROMAN URDU ONLY
     if translated_user_message['lang'] == 'urdu':
-        messages.append({"role": "system", "content": "Respond in Roman Urdu (English script with Urdu words). Keep tool arguments in English."})
+        hints.append({"role": "system", "content": "Respond in Roman Urdu (English script with Urdu words). Keep tool arguments in English."})
     else:
-        messages.append({"role": "system", "content": "Respond in English. Keep tool arguments in English."})
+        hints.append({"role": "system", "content": "Respond in English. Keep tool arguments in English."})
     
     # Strict tool usage
-    messages.append({"role": "system", "content": "For any slots/dates/times, call availability_tool and only present what it returns. If the user challenges availability, re-check availability_tool for the mentioned date and correct yourself. Use the current date context provided above for date calculations."})
+    hints.append({"role": "system", "content": "For any slots/dates/times, call availability_tool and only present what it returns. If the user challenges availability, re-check availability_tool for the mentioned date and correct yourself. Use the current date context provided above for date calculations."})
     # Fallback rule hint
-    messages.append({"role": "system", "content": "If doctor_lookup returns empty, suggest a General Physician (Dr. Ali) instead of saying no doctors available."})
+    hints.append({"role": "system", "content": "If doctor_lookup returns empty, suggest a General Physician (Dr. Ali) instead of saying no doctors available."})
     # Booking summary hint
-    messages.append({"role": "system", "content": "CRITICAL: Before booking, you MUST display a COMPLETE summary showing ALL collected patient information (name, email, phone, age, sex), doctor details, date, time, visit mode, fee, and clinic. If visit mode (online/in-person) is not provided, ASK the user to choose. NEVER skip the complete summary. NEVER book without explicit confirmation."})
+    hints.append({"role": "system", "content": "CRITICAL: Before booking, you MUST display a COMPLETE summary showing ALL collected patient information (name, email, phone, age, sex), doctor details, date, time, visit mode, fee, and clinic. If visit mode (online/in-person) is not provided, ASK the user to choose. NEVER skip the complete summary. NEVER book without explicit confirmation."})
 
-    messages.append({"role": "user", "content": body.user})
+    return session_id, session, hints + [{"role": "user", "content": body.user}]
 
-    client = OpenAI(api_key=OPENAI_API_KEY)
+@app.post("/chat")
+async def chat(body: ChatIn):
+    if not OPENAI_API_KEY:
+        raise HTTPException(status_code=500, detail="OPENAI_API_KEY missing")
+    
+    session_id, session, turn = await _prepare_turn(body)
+    history = session["history"]
+
+    # Identical context seen recently: reuse its reply
+    cache_key = _response_cache_key(history, turn)
+    cached = RESPONSE_CACHE.get(cache_key) if cache_key else None
+    if cached is not None:
+        history.extend([turn[-1], {"role": "assistant", "content": cached}])
+        _trim_history(history)
+        await _save_session(session_id, session)
+        return {"session_id": session_id, "assistant": cached}
+
+    messages = _build_prompt(history, turn)
+    # Everything from the user message onwards (tool calls, tool results, reply) is kept in history
+    persist_from = len(messages) - 1
 
     # Tool loop with retry logic
     max_retries = 3
     retry_count = 0
+    used_tools = False
     
     while retry_count < max_retries:
         try:
-            resp = client.chat.completions.create(
+            # This loop already retries the whole round, so the completion itself is tried once
+            resp = await _chat_completion(
+                attempts=1,
                 model=OPENAI_MODEL,
                 messages=messages,
-                tools=[{"type": "function", "function": f} for f in FUNCTIONS],
+                tools=TOOLS_PAYLOAD,
                 tool_choice="auto",
                 temperature=0.3,
             )
             msg = resp.choices[0].message
             if msg.tool_calls:
+                used_tools = True
                 messages.append({
                     "role": "assistant",
-                    "tool_calls": [tc.model_dump() if hasattr(tc, 'model_dump') else {
+                    "tool_calls": [{
                         "id": tc.id, "type": "function", "function": {"name": tc.function.name, "arguments": tc.function.arguments}
                     } for tc in msg.tool_calls]
                 })
-                for tc in msg.tool_calls:
-                    fn = tc.function.name
-                    try:
-                        raw_args = json.loads(tc.function.arguments or "{}")
-                    except Exception:
-                        raw_args = {}
-                    try:
-                        result_json = await mcp_call(fn, raw_args)
-                        # Update session state based on tool results
-                        if fn == "doctor_lookup" and isinstance(result_json, dict):
-                            doctors = result_json.get("result", [])
-                            if isinstance(doctors, list):
-                                session["last_doctor_options"] = doctors
-                        elif fn == "availability_tool" and isinstance(result_json, dict):
-                            avail_data = result_json.get("result", {})
-                            if isinstance(avail_data, dict):
-                                session["last_availability"] = {
-                                    "doctor_name": avail_data.get("doctor_name"),
-                                    "date": avail_data.get("date"),
-                                    "slots": avail_data.get("slots", [])
-                                }
-                    except Exception as e:
-                        result_json = {"error": str(e)}
-                    messages.append({
-                        "role": "tool",
-                        "tool_call_id": tc.id,
-                        "name": fn,
-                        "content": json.dumps(result_json)
-                    })
+                messages.extend(await _run_tool_calls(
+                    [(tc.id, tc.function.name, tc.function.arguments) for tc in msg.tool_calls], session
+                ))
                 continue
             # final
             content = msg.content or ""
             # Apply forced formatting fix
             content = _force_proper_formatting(content)
             messages.append({"role": "assistant", "content": content})
+            history.extend(messages[persist_from:])
+            _trim_history(history)
+            await _save_session(session_id, session)
+            # Tool results are live calendar data, so only tool-free replies are cached
+            if cache_key and not used_tools:
+                RESPONSE_CACHE[cache_key] = content
             return {"session_id": session_id, "assistant": content}
             
         except Exception as e:
             retry_count += 1
             if retry_count >= max_retries:
                 raise HTTPException(status_code=500, detail=f"Failed after {max_retries} retries: {str(e)}")
-            # Wait before retry with exponential backoff
-            await asyncio.sleep(2 ** retry_count)
+            await asyncio.sleep(_retry_delay(e, retry_count))
+
+_REPLAY_WORDS_PER_FRAME = 24
 
 @app.post("/chat/stream")
 async def chat_stream(body: ChatIn):
@@ -703,156 +1051,180 @@ async def chat_stream(body: ChatIn):
     if not OPENAI_API_KEY:
         raise HTTPException(status_code=500, detail="OPENAI_API_KEY missing")
     
-    session_id = body.session_id or str(uuid.uuid4())
-    session = SESSIONS.setdefault(session_id, {"messages": [{"role": "system", "content": SYSTEM_PROMPT}]})
-    messages = session["messages"]
+    session_id, session, turn = await _prepare_turn(body)
+    history = session["history"]
 
-    # Inject current date context
-    date_context = _get_current_date_context()
-    messages.append({"role": "system", "content": date_context})
-
-    # Inject normalization hint if roman Urdu tokens detected
-    hint = _normalization_hint(body.user)
-    if hint:
-        messages.append({"role": "system", "content": hint})
-
-    # Session memory hint - maintain conversation context
-    session_hint = _build_session_hint(session)
-    messages.append({"role": "system", "content": session_hint})
-    
-    # Translate user message to English and inject hint
-    translated_user_message = _translate_to_english(body.user)
-    messages.append({"role": "system", "content": f"User message in {translated_user_message['lang']}: {body.user}\nEnglish translation: {translated_user_message['english']}"})
-    # Intent classification hint
-    _intent = _classify_intent_condition(translated_user_message['english'])
-    if _intent:
-        messages.append({"role": "system", "content": f"Intent condition: {_intent}. If symptoms are present, call doctor_lookup with condition='{_intent}'. When showing results, ALWAYS display as 'Dr. [Name] - [Specialization]' format."})
-        # Update session with detected condition
-        session["last_condition"] = _intent
-    # Update session with language
-    session["lang"] = translated_user_message['lang']
-    
-    # General doctor availability detection
-    if _detect_general_doctor_query(translated_user_message['english']):
-        messages.append({"role": "system", "content": "User is asking about general doctor availability. Call list_doctors to show all available doctors. MANDATORY: Display each doctor as 'Dr. [Name] - [Specialization]' with their experience, fees, and schedule. Example: 'Dr. Eric - Ophthalmology (7 years, PKR 2500 online)'"})
-        session["last_query_type"] = "general_doctors"
-    
-    # Doctor name detection
-    detected_doctor = _detect_doctor_name(translated_user_message['english'])
-    if detected_doctor:
-        messages.append({"role": "system", "content": f"User asking about specific doctor: {detected_doctor}. Call doctor_lookup_by_name with doctor_name='{detected_doctor}' to find the doctor, then doctor_weekly_availability to show their schedule for next 7 days. When displaying doctor info, ALWAYS show as 'Dr. [Name] - [Specialization]' format."})
-        session["last_doctor_query"] = detected_doctor
-    
-    
-    # Reply language hint - RESTRICTED TO ENGLISH AND ROMAN URDU ONLY
-    if translated_user_message['lang'] == 'urdu':
-        messages.append({"role": "system", "content": "Respond in Roman Urdu (English script with Urdu words). Keep tool arguments in English."})
-    else:
-        messages.append({"role": "system", "content": "Respond in English. Keep tool arguments in English."})
-    
-    # Strict tool usage
-    messages.append({"role": "system", "content": "For any slots/dates/times, call availability_tool and only present what it returns. If the user challenges availability, re-check availability_tool for the mentioned date and correct yourself. Use the current date context provided above for date calculations."})
-    # Fallback rule hint
-    messages.append({"role": "system", "content": "If doctor_lookup returns empty, suggest a General Physician (Dr. Ali) instead of saying no doctors available."})
-    # Booking summary hint
-    messages.append({"role": "system", "content": "CRITICAL: Before booking, you MUST display a COMPLETE summary showing ALL collected patient information (name, email, phone, age, sex), doctor details, date, time, visit mode, fee, and clinic. If visit mode (online/in-person) is not provided, ASK the user to choose. NEVER skip the complete summary. NEVER book without explicit confirmation."})
-
-    messages.append({"role": "user", "content": body.user})
-
-    client = OpenAI(api_key=OPENAI_API_KEY)
+    cache_key = _response_cache_key(history, turn)
+    cached = RESPONSE_CACHE.get(cache_key) if cache_key else None
+    messages = _build_prompt(history, turn)
+    persist_from = len(messages) - 1
 
     async def generate():
         try:
-            # First, try to get a complete response without streaming to handle tool calls
+            if cached is not None:
+                history.extend([turn[-1], {"role": "assistant", "content": cached}])
+                _trim_history(history)
+                await _save_session(session_id, session)
+                # Replay in frames of a couple dozen words; there is no model latency to mask
+                words = cached.split()
+                for i in range(0, len(words), _REPLAY_WORDS_PER_FRAME):
+                    chunk = " ".join(words[i:i + _REPLAY_WORDS_PER_FRAME]) + " "
+                    yield f"data: {json.dumps({'content': chunk, 'session_id': session_id})}\n\n"
+                yield f"data: {json.dumps({'done': True, 'session_id': session_id})}\n\n"
+                return
+
+            # Every round streams; text deltas go straight to the client while tool-call deltas are assembled
             max_retries = 3
             retry_count = 0
+            used_tools = False
             
             while retry_count < max_retries:
+                streamed = False
                 try:
-                    resp = client.chat.completions.create(
+                    parts: list[str] = []
+                    pending_calls: Dict[int, Dict[str, Any]] = {}
+                    # aclosing releases the concurrency permit promptly if the client disconnects mid-stream
+                    async with aclosing(_stream_chat_completion(
                         model=OPENAI_MODEL,
                         messages=messages,
-                        tools=[{"type": "function", "function": f} for f in FUNCTIONS],
+                        tools=TOOLS_PAYLOAD,
                         tool_choice="auto",
                         temperature=0.3,
-                    )
-                    msg = resp.choices[0].message
+                    )) as resp:
+                        async for chunk in resp:
+                            if not chunk.choices:
+                                continue
+                            delta = chunk.choices[0].delta
+                            for tc in delta.tool_calls or []:
+                                call = pending_calls.setdefault(tc.index, {"id": None, "type": "function", "function": {"name": "", "arguments": ""}})
+                                if tc.id:
+                                    call["id"] = tc.id
+                                if tc.function and tc.function.name:
+                                    call["function"]["name"] += tc.function.name
+                                if tc.function and tc.function.arguments:
+                                    call["function"]["arguments"] += tc.function.arguments
+                            if delta.content:
+                                parts.append(delta.content)
+                                streamed = True
+                                yield f"data: {json.dumps({'content': delta.content, 'session_id': session_id})}\n\n"
                     
-                    if msg.tool_calls:
+                    if pending_calls:
                         # Handle tool calls
-                        messages.append({
-                            "role": "assistant",
-                            "tool_calls": [tc.model_dump() if hasattr(tc, 'model_dump') else {
-                                "id": tc.id, "type": "function", "function": {"name": tc.function.name, "arguments": tc.function.arguments}
-                            } for tc in msg.tool_calls]
-                        })
+                        used_tools = True
+                        tool_calls = [pending_calls[i] for i in sorted(pending_calls)]
+                        messages.append({"role": "assistant", "content": "".join(parts) or None, "tool_calls": tool_calls})
                         
-                        for tc in msg.tool_calls:
-                            fn = tc.function.name
-                            try:
-                                raw_args = json.loads(tc.function.arguments or "{}")
-                            except Exception:
-                                raw_args = {}
-                            try:
-                                result_json = await mcp_call(fn, raw_args)
-                                # Update session state based on tool results
-                                if fn == "doctor_lookup" and isinstance(result_json, dict):
-                                    doctors = result_json.get("result", [])
-                                    if isinstance(doctors, list):
-                                        session["last_doctor_options"] = doctors
-                                elif fn == "availability_tool" and isinstance(result_json, dict):
-                                    avail_data = result_json.get("result", {})
-                                    if isinstance(avail_data, dict):
-                                        session["last_availability"] = {
-                                            "doctor_name": avail_data.get("doctor_name"),
-                                            "date": avail_data.get("date"),
-                                            "slots": avail_data.get("slots", [])
-                                        }
-                            except Exception as e:
-                                result_json = {"error": str(e)}
-                            # Track availability date for ISO echoing
-                            try:
-                                payload = result_json.get("result") if isinstance(result_json, dict) else result_json
-                                if fn == "availability_tool" and isinstance(payload, dict):
-                                    last_avail_date = payload.get("date")
-                            except Exception:
-                                pass
-                            messages.append({
-                                "role": "tool",
-                                "tool_call_id": tc.id,
-                                "name": fn,
-                                "content": json.dumps(result_json)
-                            })
+                        messages.extend(await _run_tool_calls(
+                            [(tc["id"], tc["function"]["name"], tc["function"]["arguments"]) for tc in tool_calls], session
+                        ))
                         
                         # Continue the loop to get the final response
                         continue
                     
                     # Final response without tool calls
-                    content = msg.content or ""
+                    raw_content = "".join(parts)
                     # Apply forced formatting fix
-                    content = _force_proper_formatting(content)
+                    content = _force_proper_formatting(raw_content)
                     messages.append({"role": "assistant", "content": content})
+                    history.extend(messages[persist_from:])
+                    _trim_history(history)
+                    await _save_session(session_id, session)
+                    if cache_key and not used_tools:
+                        RESPONSE_CACHE[cache_key] = content
                     
-                    # Stream the final content
-                    words = content.split()
-                    for i, word in enumerate(words):
-                        yield f"data: {json.dumps({'content': word + ' ', 'session_id': session_id})}\n\n"
-                        await asyncio.sleep(0.05)  # Small delay for streaming effect
-                    
-                    yield f"data: {json.dumps({'done': True, 'session_id': session_id})}\n\n"
+                    done = {'done': True, 'session_id': session_id}
+                    if content != raw_content:
+                        # The streamed text needed reformatting; the client swaps in the fixed version
+                        done['replace'] = content
+                    yield f"data: {json.dumps(done)}\n\n"
                     return
                     
                 except Exception as e:
                     retry_count += 1
-                    if retry_count >= max_retries:
+                    # Text already reached the client, so a retry would duplicate it
+                    if streamed or retry_count >= max_retries:
                         raise e
-                    await asyncio.sleep(2 ** retry_count)
+                    await asyncio.sleep(_retry_delay(e, retry_count))
             
         except Exception as e:
             yield f"data: {json.dumps({'error': str(e)})}\n\n"
 
-    return StreamingResponse(generate(), media_type="text/plain")
+    return StreamingResponse(generate(), media_type="text/event-stream")
 
+@app.post("/chat/batch")
+async def chat_batch(body: list[ChatIn]):
+    """
+    Submit many single-shot chat turns to the OpenAI Batch API (half the token cost, results within 24h).
+    Items are answered without session history, and any tool calls are returned as-is, not executed.
+    """
+    if not OPENAI_API_KEY:
+        raise HTTPException(status_code=500, detail="OPENAI_API_KEY missing")
+    if not body:
+        raise HTTPException(status_code=400, detail="Batch is empty")
+
+    lines = []
+    custom_ids = []
+    for i, item in enumerate(body):
+        # custom_id must be unique within a batch, so prefix the position
+        custom_id = f"{i}:{item.session_id or uuid.uuid4()}"
+        custom_ids.append(custom_id)
+        lines.append(json.dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": OPENAI_MODEL,
+                "messages": _build_prompt([], [{"role": "user", "content": item.user}]),
+                "tools": TOOLS_PAYLOAD,
+                "tool_choice": "auto",
+                "temperature": 0.3,
+            },
+        }))
+    upload = await _with_retries(
+        ASYNC_CLIENT.files.create,
+        file=("chat_batch.jsonl", "\n".join(lines).encode("utf-8")),
+        purpose="batch",
+    )
+    batch = await _with_retries(
+        ASYNC_CLIENT.batches.create,
+        input_file_id=upload.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    return {"batch_id": batch.id, "status": batch.status, "custom_ids": custom_ids}
+
+@app.get("/chat/batch/{batch_id}")
+async def chat_batch_status(batch_id: str):
+    """Poll a submitted batch; once completed, return each item's assistant reply."""
+    if not OPENAI_API_KEY:
+        raise HTTPException(status_code=500, detail="OPENAI_API_KEY missing")
+    batch = await _with_retries(ASYNC_CLIENT.batches.retrieve, batch_id)
+    out: Dict[str, Any] = {"batch_id": batch.id, "status": batch.status}
+    if batch.status != "completed" or not batch.output_file_id:
+        return out
+
+    content = await _with_retries(ASYNC_CLIENT.files.content, batch.output_file_id)
+    results = []
+    for line in content.text.splitlines():
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        entry: Dict[str, Any] = {"custom_id": row.get("custom_id")}
+        if row.get("error"):
+            entry["error"] = row["error"]
+        else:
+            try:
+                message = row["response"]["body"]["choices"][0]["message"]
+                entry["assistant"] = _force_proper_formatting(message.get("content") or "")
+                entry["tool_calls"] = message.get("tool_calls") or []
+            except (KeyError, IndexError, TypeError):
+                entry["error"] = {"message": "Malformed batch response"}
+        results.append(entry)
+    out["results"] = results
+    return out
+
+# Request bodies for the REST tool routes hold only flat scalar fields, so handlers pass
+# body.__dict__ straight to the tool instead of re-walking the model with model_dump()
 class DoctorLookupIn(BaseModel):
     condition: str
     visit_mode: Optional[str] = "any"
@@ -897,38 +1269,42 @@ class RehydrateIn(BaseModel):
     session_id: str
     messages: list[dict]
 
+def _json_response(payload: Any) -> Response:
+    """Serialize a tool result directly; tool payloads are plain JSON, so jsonable_encoder is skipped."""
+    return Response(content=_json_dumps(payload), media_type="application/json")
+
 @app.get("/health")
 async def health():
     return {"ok": True}
 
 @app.post("/doctor-lookup")
 async def doctor_lookup(body: DoctorLookupIn):
-    return await mcp_call("doctor_lookup", body.model_dump())
+    return _json_response(await mcp_call("doctor_lookup", body.__dict__))
 
 @app.post("/availability")
 async def availability(body: AvailabilityIn):
-    return await mcp_call("availability_tool", body.model_dump())
+    return _json_response(await mcp_call("availability_tool", body.__dict__))
 
 @app.post("/book")
 async def book(body: BookIn):
-    return await mcp_call("appointment_book_tool", body.model_dump())
+    return _json_response(await mcp_call("appointment_book_tool", body.__dict__))
 
 @app.post("/appointments")
 async def list_appts(body: ListApptsIn):
-    return await mcp_call("list_appointments_tool", body.model_dump())
+    return _json_response(await mcp_call("list_appointments_tool", body.__dict__))
 
 @app.post("/cancel")
 async def cancel(body: CancelIn):
-    return await mcp_call("cancel_appointment_tool", body.model_dump())
+    return _json_response(await mcp_call("cancel_appointment_tool", body.__dict__))
 
 @app.post("/reschedule")
 async def reschedule(body: RescheduleIn):
-    return await mcp_call("reschedule_tool", body.model_dump())
+    return _json_response(await mcp_call("reschedule_tool", body.__dict__))
 
 @app.post("/rehydrate")
 async def rehydrate(body: RehydrateIn):
-    # Rebuild session messages with system prompt and provided history
-    session = SESSIONS.setdefault(body.session_id, {"messages": [{"role": "system", "content": SYSTEM_PROMPT}]})
+    # Rebuild session history from the client-provided transcript
+    session = await _load_session(body.session_id)
     # Filter only valid roles/content
     cleaned = []
     for m in body.messages:
@@ -939,25 +1315,33 @@ async def rehydrate(body: RehydrateIn):
                 cleaned.append({"role": role, "content": content})
         except Exception:
             continue
-    # Keep only last 50 messages to bound memory
-    session["messages"] = session["messages"][:1] + cleaned[-50:]
+    # Same bound as live turns
+    session["history"] = cleaned
+    _trim_history(session["history"])
+    await _save_session(body.session_id, session)
     return {"ok": True, "session_id": body.session_id, "count": len(cleaned)}
 
 
 def main():
-    import uvicorn, webbrowser, threading, time
+    global BROWSER_URL
+    import uvicorn
     port = int(os.getenv("PORT", "8000"))
     # Default to chat page
     url = os.getenv("APP_OPEN_URL", f"http://localhost:{port}/ui/chat.html")
+    workers = int(os.getenv("WORKERS", "1"))
+    # Each worker keeps its own SESSIONS, so several workers are only safe with the shared Redis store
+    if workers > 1 and REDIS is None:
+        print("[api] WARN: WORKERS > 1 needs REDIS_URL for shared sessions; running a single worker.")
+        workers = 1
+    if workers > 1:
+        # Workers re-import the app by name; nobody owns the browser, so just point at the UI
+        print(f"[api] Serving {workers} workers; chat UI at {url}")
+        uvicorn.run("api:app", host="0.0.0.0", port=port, workers=workers)
+        return
     if os.getenv("OPEN_BROWSER", "1") != "0":
-        def _open():
-            time.sleep(1.5)
-            try:
-                webbrowser.open(url)
-            except Exception:
-                pass
-        threading.Thread(target=_open, daemon=True).start()
-    uvicorn.run("api:app", host="0.0.0.0", port=port)
+        BROWSER_URL = url
+    # Pass the app object so the lifespan sees BROWSER_URL even when run as `python api.py`
+    uvicorn.run(app, host="0.0.0.0", port=port)
 
 if __name__ == "__main__":
     main()
@@ -1,5 +1,5 @@
 # client.py
-import os, json, asyncio
+import os, json, asyncio, atexit, sys, time
 from openai import OpenAI
 from mcp.client.stdio import stdio_client, StdioServerParameters
 from mcp.client.session import ClientSession
@@ -7,6 +7,7 @@ from dotenv import load_dotenv
 import re
 from datetime import datetime, timedelta, date
 from zoneinfo import ZoneInfo
+from cachetools import TTLCache
 
 # Load environment variables from .env
 load_dotenv()
@@ -159,7 +160,11 @@ FUNCTIONS = [
     }
 ]
 
+# Built once; passed unchanged to every completion call
+TOOLS_PAYLOAD = [{"type": "function", "function": f} for f in FUNCTIONS]
+
 CLINIC_TZ = os.getenv("CLINIC_TIMEZONE", "Asia/Karachi")
+CLINIC_ZONE = ZoneInfo(CLINIC_TZ)
 
 WEEKDAYS = {
     "monday": 0, "mon": 0,
@@ -172,17 +177,51 @@ WEEKDAYS = {
 }
 
 
+# Plurals are listed rather than matched with "s?", which would also accept "thus", "mons" or "upcomings"
+_WEEKDAY_FORMS = {**WEEKDAYS, **{f"{name}s": idx for name, idx in WEEKDAYS.items() if name.endswith("day")}}
+_RELATIVE_DAY_WORDS = ("today", "tomorrow", "tmrw", "tmr", "tommorrow", "upcoming")
+
+
+def _word_re(words) -> re.Pattern:
+    # Longest first so "tuesday" wins over "tue"; whole words only, so "month", "wedding" or "sunny" don't count
+    return re.compile(r"\b(?:" + "|".join(map(re.escape, sorted(words, key=len, reverse=True))) + r")\b")
+
+
+_WEEKDAY_NAME_RE = _word_re(_WEEKDAY_FORMS)
+_WEEKDAY_PHRASE_RE = _word_re([*_WEEKDAY_FORMS, *_RELATIVE_DAY_WORDS])
+_WEEKDAY_OR_TODAY_RE = _word_re([*_WEEKDAY_FORMS, "today", "tomorrow"])
+
+
 def contains_weekday_phrase(text: str) -> bool:
-    t = (text or "").lower()
-    if any(k in t for k in WEEKDAYS.keys()):
-        return True
-    if any(k in t for k in ["today", "tomorrow", "tmrw", "tmr", "tommorrow", "upcoming"]):
-        return True
-    return False
+    return _WEEKDAY_PHRASE_RE.search((text or "").lower()) is not None
+
+
+_ISO_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+# (monotonic timestamp, clinic date); the date is recomputed at most once a second
+_LOCAL_TODAY: tuple[float, date] | None = None
+
+
+def _clinic_today() -> date:
+    global _LOCAL_TODAY
+    now = time.monotonic()
+    if _LOCAL_TODAY is None or now - _LOCAL_TODAY[0] >= 1.0:
+        _LOCAL_TODAY = (now, datetime.now(CLINIC_ZONE).date())
+    return _LOCAL_TODAY[1]
+
+
+def _valid_iso_date(value: str) -> bool:
+    # Shape check first so free text never reaches the exception path
+    if not _ISO_DATE_RE.match(value):
+        return False
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
 
 
 def next_weekday(target_idx: int, today: date | None = None) -> date:
-    today = today or datetime.now(ZoneInfo(CLINIC_TZ)).date()
+    today = today or _clinic_today()
     delta = (target_idx - today.weekday()) % 7
     if delta == 0:
         delta = 7
@@ -191,32 +230,24 @@ def next_weekday(target_idx: int, today: date | None = None) -> date:
 
 def to_iso_date_from_phrase(text: str, today: date | None = None) -> str | None:
     t = text.lower().strip()
-    base_today = today or datetime.now(ZoneInfo(CLINIC_TZ)).date()
+    base_today = today or _clinic_today()
     if t in ("today",):
         return base_today.isoformat()
     if t in ("tomorrow",):
         return (base_today + timedelta(days=1)).isoformat()
-    for key, idx in WEEKDAYS.items():
-        if key in t:
-            return next_weekday(idx, today=base_today).isoformat()
+    m = _WEEKDAY_NAME_RE.search(t)
+    if m:
+        return next_weekday(_WEEKDAY_FORMS[m.group()], today=base_today).isoformat()
     # Already ISO?
-    try:
-        _ = datetime.fromisoformat(t)
-        if len(t) == 10:
-            return t
-    except Exception:
-        return None
+    if _valid_iso_date(t):
+        return t
     return None
 
 
 def ensure_iso_date(input_value: str, fallback_text: str, today: date | None = None) -> str | None:
     # If already YYYY-MM-DD
-    try:
-        if len(input_value) == 10:
-            datetime.fromisoformat(input_value)
-            return input_value
-    except Exception:
-        pass
+    if _valid_iso_date(input_value):
+        return input_value
     # Try phrase using provided 'today'
     guess = to_iso_date_from_phrase(input_value, today=today)
     if guess:
@@ -226,16 +257,22 @@ def ensure_iso_date(input_value: str, fallback_text: str, today: date | None = N
     return guess2
 
 
+_NAME_TOKEN_RE = re.compile(r"[a-z]+")
+_HONORIFICS = {"dr", "doctor", "prof", "mr", "mrs", "ms"}
+
+
 class SessionState:
     def __init__(self) -> None:
         self.doctors_by_id: dict[str, dict] = {}
         self.doctors_by_name: dict[str, dict] = {}
+        self.doctors_by_token: dict[str, dict] = {}
         self.last_condition: str | None = None
         self.last_mode: str | None = None
 
     def update_from_doctors(self, doctors: list[dict]):
         self.doctors_by_id = {}
         self.doctors_by_name = {}
+        self.doctors_by_token = {}
         for d in doctors:
             if not isinstance(d, dict):
                 continue
@@ -245,6 +282,10 @@ class SessionState:
                 self.doctors_by_id[str(did)] = d
             if name:
                 self.doctors_by_name[name] = d
+                # Index each name word so free text resolves with set lookups; honorifics are shared, skip them
+                for tok in _NAME_TOKEN_RE.findall(name):
+                    if tok not in _HONORIFICS:
+                        self.doctors_by_token.setdefault(sys.intern(tok), d)
 
     def resolve_doctor_id(self, args: dict, last_user_text: str | None = None) -> str | None:
         if "doctor_id" in args and args["doctor_id"] in self.doctors_by_id:
@@ -253,11 +294,10 @@ class SessionState:
         if name and name in self.doctors_by_name:
             return self.doctors_by_name[name].get("doctor_id")
         if last_user_text:
-            t = last_user_text.lower()
-            # simple partial match on known doctor names
-            for full_name, doc in self.doctors_by_name.items():
-                parts = [p for p in full_name.split() if p]
-                if any(p in t for p in parts):
+            # Any word of a known doctor's name in the user's text
+            for tok in _NAME_TOKEN_RE.findall(last_user_text.lower()):
+                doc = self.doctors_by_token.get(tok)
+                if doc is not None:
                     return doc.get("doctor_id")
         if len(self.doctors_by_id) == 1:
             # Single result context
@@ -266,36 +306,129 @@ class SessionState:
 
 
 STATE = SessionState()
+# Server-reported 'today', keyed by the local clinic date it was fetched on
+_TODAY_CACHE: dict[str, date] = {}
+
+class MCPConnection:
+    """
+    One long-lived stdio session to server.py, reused across tool calls on the same event loop.
+    The stdio and session contexts are held open by a background task so they are entered and
+    exited in the same task, as anyio requires.
+    """
+
+    def __init__(self) -> None:
+        self.session: ClientSession | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._task: asyncio.Task | None = None
+        self._ready: asyncio.Event | None = None
+        self._closing: asyncio.Event | None = None
+        self._lock: asyncio.Lock | None = None
+
+    async def get(self) -> ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self.session = None
+            self._task = None
+            self._lock = asyncio.Lock()
+        # Concurrent tool calls must not each start their own server
+        async with self._lock:
+            if self.session is None or self._task is None or self._task.done():
+                self._ready = asyncio.Event()
+                self._closing = asyncio.Event()
+                self._task = loop.create_task(self._hold_open())
+                await self._ready.wait()
+                if self.session is None:
+                    # Startup failed; surface the server's error
+                    self._task.result()
+                    raise RuntimeError("MCP server closed during startup")
+            return self.session
+
+    async def _hold_open(self) -> None:
+        server_params = StdioServerParameters(
+            command="python",
+            args=[SERVER_PATH],
+            env=os.environ.copy()
+        )
+        try:
+            async with stdio_client(server_params) as (read_stream, write_stream):
+                async with ClientSession(read_stream, write_stream) as session:
+                    await session.initialize()
+                    self.session = session
+                    self._ready.set()
+                    await self._closing.wait()
+        finally:
+            self.session = None
+            self._ready.set()
+
+    async def close(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._closing.set()
+            try:
+                await self._task
+            except Exception:
+                pass
+
+
+MCP = MCPConnection()
+
+# Every tool call is an IPC round-trip, so repeated read-only calls are answered locally.
+# The server reloads doctors.json when it changes, so directory lookups are kept for a minute;
+# calendar reads are kept briefly and dropped as soon as a booking, cancellation or reschedule goes through.
+_MUTATING_TOOLS = {"appointment_book_tool", "cancel_appointment_tool", "reschedule_tool"}
+_DIRECTORY_TOOLS = {"doctor_lookup", "doctor_lookup_by_name", "list_doctors"}
+_DIRECTORY_CACHE: TTLCache = TTLCache(maxsize=256, ttl=int(os.getenv("DIRECTORY_CACHE_TTL_SECONDS", "60")))
+_LIVE_CACHE: TTLCache = TTLCache(maxsize=256, ttl=30)
+# Bumped by every mutating call; a read that overlapped a mutation must not be cached
+_LIVE_GENERATION = [0]
 
 async def mcp_call(tool_name: str, args: dict):
-    server_params = StdioServerParameters(
-        command="python",
-        args=[SERVER_PATH],
-        env=os.environ.copy()
-    )
-    async with stdio_client(server_params) as (read_stream, write_stream):
-        session = ClientSession(read_stream, write_stream)
-        async with session:
-            await session.initialize()
-            result = await session.call_tool(name=tool_name, arguments=args)
-            # Prefer structured content if present
-            if getattr(result, "structuredContent", None) is not None:
-                return result.structuredContent
-            # Otherwise parse text content; if multiple items, aggregate JSON elements
-            items = []
-            if getattr(result, "content", None):
-                for content_item in result.content:
-                    if hasattr(content_item, 'text') and content_item.text:
-                        try:
-                            parsed = json.loads(content_item.text)
-                            items.append(parsed)
-                        except Exception:
-                            items.append({"raw_text": content_item.text})
-            if len(items) == 1:
-                return items[0]
-            if items:
-                return items
-            return {"ok": True}
+    if tool_name in _MUTATING_TOOLS:
+        _LIVE_GENERATION[0] += 1
+        _LIVE_CACHE.clear()
+        try:
+            return await _mcp_call_uncached(tool_name, args)
+        finally:
+            _LIVE_GENERATION[0] += 1
+            _LIVE_CACHE.clear()
+    cache = _DIRECTORY_CACHE if tool_name in _DIRECTORY_TOOLS else _LIVE_CACHE
+    key = (tool_name, json.dumps(args, sort_keys=True))
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    generation = _LIVE_GENERATION[0]
+    result = await _mcp_call_uncached(tool_name, args)
+    if not (isinstance(result, dict) and "error" in result):
+        if cache is _DIRECTORY_CACHE or generation == _LIVE_GENERATION[0]:
+            cache[key] = result
+    return result
+
+async def _mcp_call_uncached(tool_name: str, args: dict):
+    session = await MCP.get()
+    try:
+        result = await session.call_tool(name=tool_name, arguments=args)
+    except Exception:
+        # Drop a broken connection so the next call starts a fresh server
+        await MCP.close()
+        raise
+    # Prefer structured content if present
+    if getattr(result, "structuredContent", None) is not None:
+        return result.structuredContent
+    # Otherwise parse text content; if multiple items, aggregate JSON elements
+    items = []
+    if getattr(result, "content", None):
+        for content_item in result.content:
+            if hasattr(content_item, 'text') and content_item.text:
+                try:
+                    parsed = json.loads(content_item.text)
+                    items.append(parsed)
+                except Exception:
+                    items.append({"raw_text": content_item.text})
+    if len(items) == 1:
+        return items[0]
+    if items:
+        return items
+    return {"ok": True}
 
 
 def normalize_tool_args(fn: str, args: dict, last_user_text: str, last_assistant_text: str = "") -> dict:
@@ -308,7 +441,7 @@ def normalize_tool_args(fn: str, args: dict, last_user_text: str, last_assistant
         # Normalize date
         d = a.get("date")
         # Detect weekday phrase presence in user text
-        has_weekday_phrase = any(k in last_user_text.lower() for k in WEEKDAYS.keys()) or any(w in last_user_text.lower() for w in ["today", "tomorrow"]) 
+        has_weekday_phrase = _WEEKDAY_OR_TODAY_RE.search(last_user_text.lower()) is not None
         if isinstance(d, str):
             # If user provided a weekday phrase, prefer recomputing from that phrase even if model provided ISO
             if has_weekday_phrase:
@@ -350,18 +483,59 @@ def normalize_tool_args(fn: str, args: dict, last_user_text: str, last_assistant
 def get_current_date_context() -> str:
     """Get current date context for the system prompt."""
     try:
-        import pytz
-        from datetime import datetime
-        tz = pytz.timezone(CLINIC_TZ)
-        now = datetime.now(tz)
+        now = datetime.now(CLINIC_ZONE)
         return f"Current date: {now.strftime('%A, %B %d, %Y')} ({now.strftime('%Y-%m-%d')})\nCurrent time: {now.strftime('%H:%M:%S')} ({now.tzinfo})\nToday is {now.strftime('%A')} (weekday index: {now.weekday()})"
     except Exception as e:
         return f"Current date: Unable to get date ({str(e)})"
 
+# Leading system prompt + date context, then at most this many recent dialogue entries
+_PINNED_MESSAGES = 2
+# At least one, since a zero would turn the slice below into messages[2:-0], which deletes nothing
+MAX_HISTORY_MESSAGES = max(1, int(os.getenv("MAX_HISTORY_MESSAGES", "30")))
+
+
+def _compact_messages(messages: list[dict]) -> None:
+    """Drop the oldest dialogue entries in place so the prompt stays bounded across turns."""
+    del messages[_PINNED_MESSAGES:-MAX_HISTORY_MESSAGES]
+    # A tool reply is only valid right after the assistant message that requested it
+    while len(messages) > _PINNED_MESSAGES and messages[_PINNED_MESSAGES].get("role") == "tool":
+        del messages[_PINNED_MESSAGES]
+
+
+# One pass over a reply to see whether it talks about slots or bookings ("google" marks calendar links, not a booking claim)
+_NUDGE_RE = re.compile(r"(?P<availability>availab|slot|schedule)|(?P<booking>book|reserve|appointment)|(?P<google>google)")
+# A clock time such as "10:30" means the reply is asserting concrete slots, not just offering to check
+_SLOT_TIME_RE = re.compile(r"\b\d{1,2}:\d{2}\b")
+
+
+async def _call_tool_safely(fn: str, args: dict):
+    try:
+        return await mcp_call(fn, args)
+    except Exception as e:
+        return {"error": str(e)}
+
+
+async def _run_tool_calls(calls: list[tuple[str, dict]]) -> list:
+    """Results in call order; read-only calls run concurrently, turns that change bookings run in order."""
+    if any(fn in _MUTATING_TOOLS for fn, _ in calls):
+        return [await _call_tool_safely(fn, args) for fn, args in calls]
+    return await asyncio.gather(*(_call_tool_safely(fn, args) for fn, args in calls))
+
+
+def _close_loop(loop: asyncio.AbstractEventLoop) -> None:
+    if loop.is_closed():
+        return
+    loop.run_until_complete(MCP.close())
+    loop.close()
+
 def run_chat():
     if not OPENAI_API_KEY:
         raise RuntimeError("OPENAI_API_KEY missing in .env")
     client = OpenAI(api_key=OPENAI_API_KEY)
+    # One loop for the whole chat so the MCP session stays open between tool calls
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    atexit.register(_close_loop, loop)
 
     messages = [{"role": "system", "content": SYSTEM_PROMPT}]
     
@@ -373,7 +547,7 @@ def run_chat():
 
     # Prefetch doctors to enable name resolution before any lookup
     try:
-        init_doctors = asyncio.run(mcp_call("list_doctors", {}))
+        init_doctors = loop.run_until_complete(mcp_call("list_doctors", {}))
         payload = init_doctors.get("result") if isinstance(init_doctors, dict) else init_doctors
         if isinstance(payload, list):
             STATE.update_from_doctors(payload)
@@ -389,31 +563,40 @@ def run_chat():
         if not user_msg:
             continue
 
-        # Fetch authoritative 'today' from server
+        # Fetch authoritative 'today' from server, only when a date phrase needs resolving
         today_override: date | None = None
-        try:
-            now_payload = asyncio.run(mcp_call("now_tool", {}))
-            now_data = now_payload.get("result") if isinstance(now_payload, dict) else now_payload
-            if isinstance(now_data, dict) and isinstance(now_data.get("date"), str):
-                today_override = datetime.fromisoformat(now_data["date"]).date()
-        except Exception:
-            pass
+        if contains_weekday_phrase(user_msg):
+            day_key = _clinic_today().isoformat()
+            today_override = _TODAY_CACHE.get(day_key)
+            if today_override is None:
+                try:
+                    now_payload = loop.run_until_complete(mcp_call("now_tool", {}))
+                    now_data = now_payload.get("result") if isinstance(now_payload, dict) else now_payload
+                    if isinstance(now_data, dict) and isinstance(now_data.get("date"), str):
+                        today_override = datetime.fromisoformat(now_data["date"]).date()
+                        _TODAY_CACHE[day_key] = today_override
+                except Exception:
+                    pass
 
         messages.append({"role": "user", "content": user_msg})
 
         nudge_attempts = 0
+        tools_called: set[str] = set()
+        forced_tool: str | None = None
         while True:
             resp = client.chat.completions.create(
                 model=MODEL,
                 messages=messages,
-                tools=[{"type": "function", "function": f} for f in FUNCTIONS],
-                tool_choice="auto",
+                tools=TOOLS_PAYLOAD,
+                tool_choice={"type": "function", "function": {"name": forced_tool}} if forced_tool else "auto",
                 temperature=0.3,
             )
             msg = resp.choices[0].message
+            forced_tool = None
 
             # Handle tool calls iteratively until there are none
             if msg.tool_calls:
+                tools_called.update(tc.function.name for tc in msg.tool_calls)
                 messages.append({
                     "role": "assistant",
                     "tool_calls": [tc.model_dump() if hasattr(tc, 'model_dump') else {
@@ -424,6 +607,7 @@ def run_chat():
                 })
 
                 pending_sys_hint: str | None = None
+                call_args: list[dict] = []
                 for tc in msg.tool_calls:
                     fn = tc.function.name
                     raw_args = json.loads(tc.function.arguments or "{}")
@@ -437,27 +621,18 @@ def run_chat():
                             forced = ensure_iso_date("", user_msg)
                         if forced:
                             args["date"] = forced
-                    elif today_override:
-                        if fn == "availability_tool":
-                            if isinstance(args.get("date"), str):
-                                fixed = ensure_iso_date(args["date"], user_msg, today=today_override)
-                                if fixed:
-                                    args["date"] = fixed
-                            elif not args.get("date"):
-                                guess = ensure_iso_date("", user_msg, today=today_override)
-                                if guess:
-                                    args["date"] = guess
-                        elif fn == "appointment_book_tool":
-                            # Booking expects full datetime; leave as provided
-                            pass
                     # Capture state after doctor_lookup
                     if fn == "doctor_lookup":
                         STATE.last_condition = raw_args.get("condition")
                         STATE.last_mode = raw_args.get("visit_mode")
-                    try:
-                        result_json = asyncio.run(mcp_call(fn, args))
-                    except Exception as e:
-                        result_json = {"error": str(e)}
+                    call_args.append(args)
+
+                # Independent calls share the persistent MCP session concurrently
+                results = loop.run_until_complete(_run_tool_calls(
+                    [(tc.function.name, args) for tc, args in zip(msg.tool_calls, call_args)]
+                ))
+                for tc, result_json in zip(msg.tool_calls, results):
+                    fn = tc.function.name
                     if fn == "doctor_lookup":
                         payload = result_json.get("result") if isinstance(result_json, dict) else result_json
                         if isinstance(payload, list):
@@ -492,10 +667,19 @@ def run_chat():
                 continue
 
             content_lower = (msg.content or "").lower()
-            mentions_availability = any(k in content_lower for k in ["availability", "available", "slot", "schedule"])
-            mentions_booking = any(k in content_lower for k in ["book", "booking", "reserve", "appointment"]) and "google" not in content_lower
-
-            if nudge_attempts < 2 and (mentions_availability or mentions_booking):
+            mentioned = {m.lastgroup for m in _NUDGE_RE.finditer(content_lower)}
+            mentions_availability = "availability" in mentioned
+            mentions_booking = "booking" in mentioned and "google" not in mentioned
+
+            # Slot times stated but never looked up this turn: re-ask once with the lookup forced,
+            # instead of a reminder the model may ignore again
+            if (nudge_attempts == 0 and mentions_availability and "availability_tool" not in tools_called
+                    and _SLOT_TIME_RE.search(content_lower)):
+                nudge_attempts += 1
+                forced_tool = "availability_tool"
+                continue
+            # Booking is never forced (it needs explicit user confirmation), so keep the reminder
+            if nudge_attempts == 0 and mentions_booking and "appointment_book_tool" not in tools_called:
                 nudge_attempts += 1
                 reminder = (
                     "Reminder: Per HARD REQUIREMENTS, you must call availability_tool before stating availability, "
@@ -507,6 +691,7 @@ def run_chat():
             print(f"\nAssistant: {msg.content}\n")
             last_assistant_textual = msg.content or ""
             messages.append({"role": "assistant", "content": msg.content or ""})
+            _compact_messages(messages)
             break
 
 
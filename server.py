@@ -1,8 +1,11 @@
 # server.py
-import os, json
+import os, re, json, threading, functools, calendar
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Literal, Dict, Any, Optional
 from datetime import datetime, timedelta, time
 import pytz
+from cachetools import TTLCache
 
 from mcp.server.fastmcp import FastMCP
 from dotenv import load_dotenv
@@ -10,9 +13,18 @@ from dotenv import load_dotenv
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
 import smtplib
+import socket
+import ssl
 from email.message import EmailMessage
 from uuid import uuid4
 from urllib.parse import urlencode
+from time import monotonic, time as _epoch_now
+
+# orjson is optional: it parses the doctor directory faster when installed, stdlib json otherwise
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 load_dotenv()
 
@@ -27,6 +39,7 @@ SMTP_PASS = os.getenv("SMTP_PASS")
 SMTP_FROM = os.getenv("SMTP_FROM")
 # New: configurable minimum lead time (in minutes) before an appointment can start
 MIN_LEAD_MINUTES = int(os.getenv("MIN_LEAD_MINUTES", "0"))
+_LEAD_SECONDS = MIN_LEAD_MINUTES * 60
 
 
 def _abs(path: str) -> str:
@@ -35,26 +48,125 @@ def _abs(path: str) -> str:
 
 DATA_PATH = _abs(DEFAULT_DATA_PATH)
 SERVICE_ACCOUNT_FILE = _abs(DEFAULT_SERVICE_ACCOUNT_FILE) if DEFAULT_SERVICE_ACCOUNT_FILE else None
+# pytz zones are immutable; resolve the clinic zone once instead of on every localize/now call
+_CLINIC_TZ = pytz.timezone(DEFAULT_TZ)
+
+
+def _project_doctor(d: Dict[str, Any]) -> Dict[str, Any]:
+    """The doctor fields the directory tools return."""
+    return {
+        "doctor_id": d.get("doctor_id"),
+        "name": d.get("name"),
+        "specialization": d.get("specialization"),
+        "experience_years": d.get("experience_years"),
+        "fees_pkr": {
+            "online": d.get("fees", {}).get("online_pkr"),
+            "inperson": d.get("fees", {}).get("inperson_pkr"),
+        },
+        "weekly_schedule": d.get("weekly_schedule", {}),
+        "location": d.get("location"),
+        "calendar_id": d.get("calendar_id"),
+        "email": d.get("email"),
+    }
+
+
+def _index_directory(db: Dict[str, Any]) -> Dict[str, Any]:
+    """Attach lookup indices and tool projections so tools don't rescan the doctor list on every call."""
+    by_id: Dict[str, Any] = {}
+    by_name_lower: Dict[str, Any] = {}
+    name_pairs = []
+    projections = []
+    projection_by_id: Dict[str, Any] = {}
+    for d in db.get("doctors", []):
+        name = str(d.get("name", "")).lower().strip()
+        by_id.setdefault(d.get("doctor_id"), d)
+        by_name_lower.setdefault(name, d)
+        name_pairs.append((name, d))
+        p = _project_doctor(d)
+        projections.append(p)
+        projection_by_id.setdefault(d.get("doctor_id"), p)
+    db["_by_id"] = by_id
+    db["_by_name_lower"] = by_name_lower
+    db["_name_pairs"] = name_pairs
+    db["_projections"] = projections
+    db["_projection_by_id"] = projection_by_id
+    return db
+
+
+def _read_directory() -> Dict[str, Any]:
+    with open(DATA_PATH, "rb") as f:
+        raw = f.read()
+    return _index_directory(orjson.loads(raw) if orjson else json.loads(raw))
+
+
+def _data_mtime() -> Optional[float]:
+    try:
+        return os.stat(DATA_PATH).st_mtime
+    except OSError:
+        return None
 
 
 def load_directory() -> Dict[str, Any]:
     try:
         if os.path.exists(DATA_PATH):
-            with open(DATA_PATH, "r", encoding="utf-8") as f:
-                return json.load(f)
+            return _read_directory()
         print(f"[server] WARN: Data file not found at {DATA_PATH}. Using empty DB.")
     except Exception as e:
         print(f"[server] ERROR: Failed loading {DATA_PATH}: {e}")
-    return {"doctors": [], "condition_map": {}}
+    return _index_directory({"doctors": [], "condition_map": {}})
 
 
+# The directory is reloaded when the data file changes; the mtime is checked at most once a second.
+DB_CHECK_SECONDS = 1.0
+_DB_LOCK = threading.Lock()
+_DB_STATE: Dict[str, Any] = {"mtime": _data_mtime(), "checked": monotonic(), "generation": 0}
 DB = load_directory()
 app = FastMCP("Hospital-MCP-Server")
 
 
+def _db() -> Dict[str, Any]:
+    global DB
+    now = monotonic()
+    if now - _DB_STATE["checked"] < DB_CHECK_SECONDS:
+        return DB
+    with _DB_LOCK:
+        if now - _DB_STATE["checked"] >= DB_CHECK_SECONDS:
+            _DB_STATE["checked"] = now
+            mtime = _data_mtime()
+            if mtime is not None and mtime != _DB_STATE["mtime"]:
+                try:
+                    DB = _read_directory()
+                    _DB_STATE["mtime"] = mtime
+                    _DB_STATE["generation"] += 1
+                    print(f"[server] Reloaded {DATA_PATH}")
+                except Exception as e:
+                    # Likely caught mid-write; keep serving the previous directory and retry next check
+                    print(f"[server] ERROR: Failed reloading {DATA_PATH}: {e}")
+    return DB
+
+
+def directory_generation() -> int:
+    """Counter bumped on every directory reload, so importers can tell when derived data is stale."""
+    _db()
+    return _DB_STATE["generation"]
+
+
 def _find_doctor(doctor_id: str) -> Optional[Dict[str, Any]]:
-    for d in DB.get("doctors", []):
-        if d.get("doctor_id") == doctor_id:
+    return _db()["_by_id"].get(doctor_id)
+
+
+def _find_doctor_by_name(doctor_name: str) -> Optional[Dict[str, Any]]:
+    db = _db()
+    name_lower = doctor_name.lower().strip()
+    if not name_lower:
+        return None
+    d = db["_by_name_lower"].get(name_lower)
+    if d is not None:
+        return d
+    # Partial match; a query too short to contain a full name only matches one direction
+    check_reverse = len(name_lower) > 3
+    for doc_name, d in db["_name_pairs"]:
+        if name_lower in doc_name or (check_reverse and doc_name and doc_name in name_lower):
             return d
     return None
 
@@ -67,47 +179,16 @@ def doctor_lookup(
     """
     Return matching doctors for a given condition and visit mode.
     """
-    ids = DB.get("condition_map", {}).get(condition, [])
-    docs = [d for d in DB.get("doctors", []) if d.get("doctor_id") in ids]
-    out = []
-    for d in docs:
-        out.append({
-            "doctor_id": d.get("doctor_id"),
-            "name": d.get("name"),
-            "specialization": d.get("specialization"),
-            "experience_years": d.get("experience_years"),
-            "fees_pkr": {
-                "online": d.get("fees", {}).get("online_pkr"),
-                "inperson": d.get("fees", {}).get("inperson_pkr"),
-            },
-            "weekly_schedule": d.get("weekly_schedule", {}),
-            "location": d.get("location"),
-            "calendar_id": d.get("calendar_id"),
-            "email": d.get("email"),
-        })
-    return out
+    db = _db()
+    ids = db.get("condition_map", {}).get(condition, [])
+    by_id = db["_projection_by_id"]
+    return [by_id[i] for i in ids if i in by_id]
 
 
 @app.tool()
 def list_doctors() -> List[Dict[str, Any]]:
     """Return the directory of doctors with basic details."""
-    out: List[Dict[str, Any]] = []
-    for d in DB.get("doctors", []):
-        out.append({
-            "doctor_id": d.get("doctor_id"),
-            "name": d.get("name"),
-            "specialization": d.get("specialization"),
-            "experience_years": d.get("experience_years"),
-            "fees_pkr": {
-                "online": d.get("fees", {}).get("online_pkr"),
-                "inperson": d.get("fees", {}).get("inperson_pkr"),
-            },
-            "weekly_schedule": d.get("weekly_schedule", {}),
-            "location": d.get("location"),
-            "calendar_id": d.get("calendar_id"),
-            "email": d.get("email"),
-        })
-    return out
+    return list(_db()["_projections"])
 
 
 @app.tool()
@@ -117,28 +198,10 @@ def doctor_lookup_by_name(
     """
     Find a doctor by name and return their details.
     """
-    name_lower = doctor_name.lower().strip()
-    
-    for d in DB.get("doctors", []):
-        doc_name = str(d.get("name", "")).lower().strip()
-        # Exact match or partial match
-        if name_lower in doc_name or doc_name in name_lower:
-            return {
-                "doctor_id": d.get("doctor_id"),
-                "name": d.get("name"),
-                "specialization": d.get("specialization"),
-                "experience_years": d.get("experience_years"),
-                "fees_pkr": {
-                    "online": d.get("fees", {}).get("online_pkr"),
-                    "inperson": d.get("fees", {}).get("inperson_pkr"),
-                },
-                "weekly_schedule": d.get("weekly_schedule", {}),
-                "location": d.get("location"),
-                "calendar_id": d.get("calendar_id"),
-                "email": d.get("email"),
-            }
-    
-    return None
+    d = _find_doctor_by_name(doctor_name)
+    if d is None:
+        return None
+    return _db()["_projection_by_id"].get(d.get("doctor_id"))
 
 
 @app.tool()
@@ -151,26 +214,22 @@ def doctor_weekly_availability(
     Get doctor's availability for the next N days based on their routine schedule + Google Calendar.
     """
     # First find the doctor
-    name_lower = doctor_name.lower().strip()
-    doctor = None
-    
-    for d in DB.get("doctors", []):
-        doc_name = str(d.get("name", "")).lower().strip()
-        if name_lower in doc_name or doc_name in name_lower:
-            doctor = d
-            break
-    
+    doctor = _find_doctor_by_name(doctor_name)
     if not doctor:
         return {"error": f"Doctor '{doctor_name}' not found"}
     
     # Get next N days availability
-    today = datetime.now(pytz.timezone(DEFAULT_TZ)).date()
+    today = datetime.now(_CLINIC_TZ).date()
     result_map = {}
     
+    first_day = datetime.combine(today, time(0, 0))
+    per_day = _compute_free_slots_for_range(
+        doctor, first_day, first_day + timedelta(days=days - 1), slot_minutes,
+    ) if days > 0 else {}
     for i in range(days):
         check_date = today + timedelta(days=i)
         date_str = check_date.isoformat()
-        slots, meta = _compute_free_slots_for_date(doctor, date_str, slot_minutes)
+        slots, meta = per_day[date_str]
         
         result_map[date_str] = {
             "day_name": check_date.strftime("%A"),
@@ -195,12 +254,33 @@ def doctor_weekly_availability(
     }
 
 
+_CREDS: Optional[Credentials] = None
+# Long-lived threads for overlapping independent Calendar calls; each keeps its own cached client
+_CALENDAR_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="calendar")
+_CREDS_LOCK = threading.Lock()
+_SERVICE_LOCAL = threading.local()
+
+
 def _google_service() -> Any:
+    """
+    Calendar client for the calling thread, built on first use and then reused.
+    Credentials are loaded once per process; the client itself is per thread because its
+    httplib2 transport is not thread-safe and tools run concurrently in worker threads.
+    """
+    service = getattr(_SERVICE_LOCAL, "service", None)
+    if service is not None:
+        return service
     if not SERVICE_ACCOUNT_FILE or not os.path.exists(SERVICE_ACCOUNT_FILE):
         raise RuntimeError("Google service account credentials not configured. Set GOOGLE_SERVICE_ACCOUNT_FILE env to a JSON file path.")
-    scopes = ["https://www.googleapis.com/auth/calendar"]
-    creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=scopes)
-    return build("calendar", "v3", credentials=creds, cache_discovery=False)
+    global _CREDS
+    with _CREDS_LOCK:
+        if _CREDS is None:
+            scopes = ["https://www.googleapis.com/auth/calendar"]
+            _CREDS = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=scopes)
+    # The discovery document ships with googleapiclient; never fetch it over the network.
+    service = build("calendar", "v3", credentials=_CREDS, cache_discovery=False, static_discovery=True)
+    _SERVICE_LOCAL.service = service
+    return service
 
 
 def _parse_time(t: str) -> time:
@@ -208,48 +288,185 @@ def _parse_time(t: str) -> time:
 
 
 def _localize(dt: datetime) -> datetime:
-    return pytz.timezone(DEFAULT_TZ).localize(dt)
+    # Inputs that already carry an offset are converted; pytz's localize() rejects them
+    if dt.tzinfo is not None:
+        return dt.astimezone(_CLINIC_TZ)
+    return _CLINIC_TZ.localize(dt)
 
 
 def _to_utc_iso(local_dt: datetime) -> str:
     return local_dt.astimezone(pytz.UTC).isoformat()
 
 
-def _overlaps(slot_start: datetime, slot_end: datetime, busy: List[Dict[str, str]]) -> bool:
-    for b in busy:
-        b_start = datetime.fromisoformat(b["start"].replace("Z", "+00:00"))
-        b_end = datetime.fromisoformat(b["end"].replace("Z", "+00:00"))
-        if slot_start < b_end and slot_end > b_start:
-            return True
-    return False
+@functools.lru_cache(maxsize=8192)
+def _rfc3339_to_epoch(value: str) -> int:
+    """Epoch seconds for an RFC 3339 timestamp; Google's UTC "...Z" form is sliced directly."""
+    if len(value) >= 20 and value[-1] == "Z" and value[10] == "T":
+        return calendar.timegm((
+            int(value[0:4]), int(value[5:7]), int(value[8:10]),
+            int(value[11:13]), int(value[14:16]), int(value[17:19]), 0, 0, 0,
+        ))
+    return int(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp())
+
+
+def _busy_intervals(busy: List[Dict[str, str]]) -> tuple[List[int], List[int]]:
+    """Freebusy intervals as sorted, merged (starts, ends) lists of epoch seconds."""
+    starts: List[int] = []
+    ends: List[int] = []
+    spans = sorted((_rfc3339_to_epoch(b["start"]), _rfc3339_to_epoch(b["end"])) for b in busy)
+    for b_start, b_end in spans:
+        if ends and b_start <= ends[-1]:
+            ends[-1] = max(ends[-1], b_end)
+        else:
+            starts.append(b_start)
+            ends.append(b_end)
+    return starts, ends
 
 
-def _send_plain_email(recipients: List[str], subject: str, body: str, ics_content: Optional[str] = None) -> tuple[bool, Optional[str]]:
-    if not SMTP_HOST or not SMTP_FROM:
-        return False, "SMTP not configured"
+def _overlaps(slot_start: int, slot_end: int, busy: tuple[List[int], List[int]]) -> bool:
+    # Intervals are disjoint and sorted, so only the first one ending after slot_start can overlap.
+    starts, ends = busy
+    i = bisect_right(ends, slot_start)
+    return i < len(starts) and starts[i] < slot_end
+
+
+# Authenticated SMTP connections are pooled and reused across sends (booking mails go out in pairs).
+# smtplib is not thread-safe, so a connection is used by one sender at a time; _SMTP_SLOTS caps how many exist.
+SMTP_IDLE_SECONDS = int(os.getenv("SMTP_IDLE_SECONDS", "100"))
+SMTP_POOL_SIZE = max(1, int(os.getenv("SMTP_POOL_SIZE", "4")))
+# Port 465 (or SMTP_SSL=1) means SMTPS: TLS from the first byte instead of STARTTLS
+SMTP_IMPLICIT_TLS = SMTP_PORT == 465 or os.getenv("SMTP_SSL", "0") == "1"
+# Built once; certificate and hostname verification stay on (smtplib passes the host as server_hostname)
+_SMTP_TLS_CONTEXT = ssl.create_default_context()
+_SMTP_SLOTS = threading.BoundedSemaphore(SMTP_POOL_SIZE)
+_SMTP_LOCK = threading.Lock()  # guards _SMTP_STATE
+_SMTP_STATE: Dict[str, Any] = {"idle": [], "tls_session": None}
+
+
+def _tune_smtp_socket(sock: socket.socket) -> socket.socket:
+    # SMTP is short command/reply lines; don't let Nagle hold them back, and give DATA room to flow
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 65536)
+    return sock
+
+
+class _NoDelaySMTP(smtplib.SMTP):
+    def _get_socket(self, host, port, timeout):
+        return _tune_smtp_socket(super()._get_socket(host, port, timeout))
+
+
+def _wrap_resuming(sock: socket.socket, server_hostname: Optional[str]) -> ssl.SSLSocket:
+    """Wrap sock offering the previous connection's TLS session, turning redials into abbreviated handshakes."""
+    session = _SMTP_STATE["tls_session"]
     try:
-        msg = EmailMessage()
-        msg["Subject"] = subject
-        msg["From"] = SMTP_FROM
-        msg["To"] = ", ".join(recipients)
-        msg.set_content(body)
-        if ics_content:
-            msg.add_attachment(
-                ics_content.encode("utf-8"),
-                maintype="text",
-                subtype="calendar",
-                filename="appointment.ics",
-                params={"method": "REQUEST", "charset": "UTF-8", "name": "appointment.ics"},
-            )
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as s:
-            s.starttls()
-            if SMTP_USER and SMTP_PASS:
-                s.login(SMTP_USER, SMTP_PASS)
-            s.send_message(msg)
-        return True, None
-    except Exception as e:
-        print(f"[smtp] ERROR: {e}")
-        return False, str(e)
+        return _SMTP_TLS_CONTEXT.wrap_socket(sock, server_hostname=server_hostname, session=session)
+    except ValueError:
+        # Session no longer usable with this context; fall back to a full handshake
+        return _SMTP_TLS_CONTEXT.wrap_socket(sock, server_hostname=server_hostname)
+
+
+class _ResumingTLSContext:
+    """Stand-in context for SMTP.starttls(), which only calls wrap_socket() and has no session argument."""
+
+    def wrap_socket(self, sock, server_hostname=None):
+        return _wrap_resuming(sock, server_hostname)
+
+
+class _ResumingSMTP_SSL(smtplib.SMTP_SSL):
+    def _get_socket(self, host, port, timeout):
+        return _wrap_resuming(_tune_smtp_socket(smtplib.SMTP._get_socket(self, host, port, timeout)), self._host)
+
+
+def _close_smtp_connection(conn: smtplib.SMTP) -> None:
+    try:
+        conn.quit()
+    except Exception:
+        conn.close()
+
+
+def _smtp_connection() -> smtplib.SMTP:
+    """Check out an idle connection that is fresh and answers NOOP; otherwise dial a new one. Caller holds an _SMTP_SLOTS slot."""
+    while True:
+        with _SMTP_LOCK:
+            if not _SMTP_STATE["idle"]:
+                break
+            conn, last_used = _SMTP_STATE["idle"].pop()
+        if monotonic() - last_used < SMTP_IDLE_SECONDS:
+            try:
+                if conn.noop()[0] == 250:
+                    return conn
+            except Exception:
+                pass
+        _close_smtp_connection(conn)
+    if SMTP_IMPLICIT_TLS:
+        # TLS is negotiated with the TCP connect; no plaintext EHLO + STARTTLS round-trip
+        conn = _ResumingSMTP_SSL(SMTP_HOST, SMTP_PORT, context=_SMTP_TLS_CONTEXT)
+    else:
+        conn = _NoDelaySMTP(SMTP_HOST, SMTP_PORT)
+    try:
+        if not SMTP_IMPLICIT_TLS:
+            conn.starttls(context=_ResumingTLSContext())
+        if SMTP_USER and SMTP_PASS:
+            conn.login(SMTP_USER, SMTP_PASS)
+    except Exception:
+        conn.close()
+        raise
+    # Keep the session (the TLS 1.3 ticket has arrived by now) so the next redial can resume it
+    with _SMTP_LOCK:
+        _SMTP_STATE["tls_session"] = getattr(conn.sock, "session", None)
+    return conn
+
+
+def _release_smtp_connection(conn: smtplib.SMTP) -> None:
+    with _SMTP_LOCK:
+        _SMTP_STATE["idle"].append((conn, monotonic()))
+
+
+def _build_email(recipients: List[str], subject: str, body: str, ics_bytes: Optional[bytes] = None) -> EmailMessage:
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["From"] = SMTP_FROM
+    msg["To"] = ", ".join(recipients)
+    msg.set_content(body)
+    if ics_bytes:
+        msg.add_attachment(
+            ics_bytes,
+            maintype="text",
+            subtype="calendar",
+            filename="appointment.ics",
+            params={"method": "REQUEST", "charset": "UTF-8", "name": "appointment.ics"},
+        )
+    return msg
+
+
+def _send_plain_email_many(messages: List[tuple[List[str], str, str, Optional[str]]]) -> List[tuple[bool, Optional[str]]]:
+    """
+    Send (recipients, subject, body, ics_content) messages over one pooled connection.
+    Returns (ok, error) per message; a failed send drops that connection and the next message redials.
+    """
+    if not SMTP_HOST or not SMTP_FROM:
+        return [(False, "SMTP not configured")] * len(messages)
+    results: List[tuple[bool, Optional[str]]] = []
+    # Patient and doctor mails carry the same invite; encode each distinct ICS body once
+    encoded_ics = {ics: ics.encode("utf-8") for _r, _s, _b, ics in messages if ics}
+    with _SMTP_SLOTS:
+        conn = None
+        for recipients, subject, body, ics_content in messages:
+            try:
+                msg = _build_email(recipients, subject, body, encoded_ics.get(ics_content))
+                if conn is None:
+                    conn = _smtp_connection()
+                conn.send_message(msg)
+                results.append((True, None))
+            except Exception as e:
+                print(f"[smtp] ERROR: {e}")
+                results.append((False, str(e)))
+                if conn is not None:
+                    _close_smtp_connection(conn)
+                    conn = None
+        if conn is not None:
+            _release_smtp_connection(conn)
+    return results
 
 
 @app.tool()
@@ -271,7 +488,7 @@ def availability_tool(
 
     # Default to today's date if date is missing/empty
     if not date or not str(date).strip():
-        date = datetime.now(pytz.timezone(DEFAULT_TZ)).date().isoformat()
+        date = datetime.now(_CLINIC_TZ).date().isoformat()
 
     if not end_date:
         slots, meta = _compute_free_slots_for_date(doctor, date, slot_minutes)
@@ -296,13 +513,13 @@ def availability_tool(
         return {"error": "Invalid date or end_date. Use YYYY-MM-DD"}
     if end_d < start_d:
         start_d, end_d = end_d, start_d
-    day = start_d
-    result_map: Dict[str, List[str]] = {}
-    while day <= end_d:
-        ds = str(day)
-        slots, _meta_unused = _compute_free_slots_for_date(doctor, ds, slot_minutes)
-        result_map[ds] = slots
-        day += timedelta(days=1)
+    per_day = _compute_free_slots_for_range(
+        doctor,
+        datetime.combine(start_d, time(0, 0)),
+        datetime.combine(end_d, time(0, 0)),
+        slot_minutes,
+    )
+    result_map: Dict[str, List[str]] = {ds: slots for ds, (slots, _meta_unused) in per_day.items()}
     return {
         "doctor_id": doctor_id,
         "doctor_name": doctor.get("name"),
@@ -314,19 +531,14 @@ def availability_tool(
     }
 
 
-def _compute_free_slots_for_date(doctor: Dict[str, Any], date: str, slot_minutes: int) -> tuple[List[str], Optional[Dict[str, str]]]:
-    schedule = doctor.get("weekly_schedule", {})
-    try:
-        day_dt = datetime.fromisoformat(date)
-        day_name = day_dt.strftime("%a")
-    except Exception:
-        return [], {"code": "invalid_date", "warning": "Invalid date format"}
-    windows = schedule.get(day_name, [])
-    if not windows:
-        return [], {"code": "no_schedule", "warning": "No clinic hours for this day"}
-    slot_ranges: List[tuple[datetime, datetime]] = []
-    earliest = None
-    latest = None
+# Google rejects freebusy windows that are too long, so long ranges are split into chunks.
+_FREEBUSY_MAX_DAYS = 31
+
+
+@functools.lru_cache(maxsize=4096)
+def _window_offsets(windows: tuple[str, ...]) -> tuple[tuple[int, int], ...]:
+    """Parse "HH:MM-HH:MM" clinic windows into (start, end) minutes from midnight."""
+    out = []
     for win in windows:
         try:
             start_s, end_s = win.split("-")
@@ -334,24 +546,61 @@ def _compute_free_slots_for_date(doctor: Dict[str, Any], date: str, slot_minutes
             end_t = _parse_time(end_s)
         except Exception:
             continue
-        day = datetime.fromisoformat(date)
-        start_local = _localize(datetime.combine(day.date(), start_t))
-        end_local = _localize(datetime.combine(day.date(), end_t))
-        if earliest is None or start_local < earliest:
-            earliest = start_local
-        if latest is None or end_local > latest:
-            latest = end_local
-        cursor = start_local
-        while cursor + timedelta(minutes=slot_minutes) <= end_local:
-            slot_ranges.append((cursor, cursor + timedelta(minutes=slot_minutes)))
-            cursor += timedelta(minutes=slot_minutes)
-    if not earliest or not latest:
-        return [], {"code": "no_schedule", "warning": "No clinic hours for this day"}
+        out.append((start_t.hour * 60 + start_t.minute, end_t.hour * 60 + end_t.minute))
+    return tuple(out)
+
+
+@functools.lru_cache(maxsize=4096)
+def _slot_offsets(windows: tuple[str, ...], slot_minutes: int) -> tuple[tuple[int, int], ...]:
+    """Slot (start, end) minutes from midnight for a day's windows; schedules are static."""
+    if slot_minutes <= 0:
+        return ()
+    return tuple(
+        (cursor, cursor + slot_minutes)
+        for w_start, w_end in _window_offsets(windows)
+        for cursor in range(w_start, w_end - slot_minutes + 1, slot_minutes)
+    )
+
+
+@functools.lru_cache(maxsize=4096)
+def _slot_labels(windows: tuple[str, ...], slot_minutes: int) -> tuple[str, ...]:
+    """"HH:MM" labels matching _slot_offsets, formatted once per schedule instead of per slot."""
+    return tuple(f"{start // 60:02d}:{start % 60:02d}" for start, _end in _slot_offsets(windows, slot_minutes))
+
+
+def _wall_clock(day: datetime, minutes: int) -> datetime:
+    """Clinic-local time `minutes` after midnight on the wall clock; localized on its own so DST days come out right."""
+    return _localize(datetime.combine(day.date(), time(0, 0)) + timedelta(minutes=minutes))
+
+
+def _day_plan(doctor: Dict[str, Any], day: datetime, slot_minutes: int) -> tuple[List[tuple[int, int]], tuple[str, ...], Optional[datetime], Optional[datetime]]:
+    """
+    Candidate slots for one day as (start, end) epoch seconds with their "HH:MM" labels,
+    plus the clinic-hours span, before any calendar check.
+    """
+    windows = tuple(doctor.get("weekly_schedule", {}).get(day.strftime("%a"), []))
+    bounds = _window_offsets(windows)
+    if not bounds:
+        return [], (), None, None
+    earliest = _wall_clock(day, min(b[0] for b in bounds))
+    latest = _wall_clock(day, max(b[1] for b in bounds))
+    offsets = _slot_offsets(windows, slot_minutes)
+    midnight = _wall_clock(day, 0)
+    if midnight.utcoffset() == _wall_clock(day, 24 * 60).utcoffset():
+        # No offset change during the day, so fixed offsets from midnight are exact
+        base = int(midnight.timestamp())
+        slots = [(base + s * 60, base + e * 60) for s, e in offsets]
+    else:
+        slots = [(int(_wall_clock(day, s).timestamp()), int(_wall_clock(day, e).timestamp())) for s, e in offsets]
+    return slots, _slot_labels(windows, slot_minutes), earliest, latest
+
+
+def _query_busy(doctor: Dict[str, Any], time_min: datetime, time_max: datetime) -> tuple[List[Dict[str, str]], Optional[Dict[str, str]]]:
     try:
         service = _google_service()
         fb = service.freebusy().query(body={
-            "timeMin": _to_utc_iso(earliest),
-            "timeMax": _to_utc_iso(latest),
+            "timeMin": _to_utc_iso(time_min),
+            "timeMax": _to_utc_iso(time_max),
             "timeZone": DEFAULT_TZ,
             "items": [{"id": doctor.get("calendar_id")}],
         }).execute()
@@ -361,45 +610,93 @@ def _compute_free_slots_for_date(doctor: Dict[str, Any], date: str, slot_minutes
             error_details = "; ".join([f"{e.get('reason')}: {e.get('domain')}" for e in cal_data.get("errors", [])])
             print(f"[freebusy] Calendar access error for {doctor.get('calendar_id')}: {error_details}")
             return [], {"code": "calendar_access_error", "warning": f"Calendar access denied. Please ensure calendar is shared with service account."}
-        busy_list = cal_data.get("busy", [])
+        return cal_data.get("busy", []), None
     except Exception as e:
         print(f"[freebusy] ERROR: {e}")
         import traceback
         traceback.print_exc()
         return [], {"code": "freebusy_error", "warning": f"Calendar query failed: {str(e)[:100]}"}
-    free_slots: List[str] = []
-    now_local = datetime.now(pytz.timezone(DEFAULT_TZ))
-    is_today = day_dt.date() == now_local.date()
-    lead_delta = timedelta(minutes=MIN_LEAD_MINUTES)
-    for s_start, s_end in slot_ranges:
-        if is_today and s_start < (now_local + lead_delta):
-            continue
-        if not _overlaps(s_start, s_end, busy_list):
-            free_slots.append(s_start.strftime("%H:%M"))
-    if not free_slots:
-        # Distinguish cause (no future slots vs fully booked)
-        any_future_candidates = any((not is_today or (rng[0] >= (now_local + lead_delta))) for rng in slot_ranges)
-        code = "no_future_slots" if not any_future_candidates else "fully_booked"
-        return [], {"code": code, "warning": "No available slots for the selected day"}
-    return free_slots, None
+
+
+def _compute_free_slots_for_range(
+    doctor: Dict[str, Any],
+    start_date: datetime,
+    end_date: datetime,
+    slot_minutes: int,
+) -> Dict[str, tuple[List[str], Optional[Dict[str, str]]]]:
+    """
+    Free slots for every day in [start_date, end_date], keyed by YYYY-MM-DD.
+    Busy intervals come from one freebusy query per chunk of days instead of one per day.
+    """
+    plans = []
+    day = start_date
+    while day.date() <= end_date.date():
+        plans.append((day, *_day_plan(doctor, day, slot_minutes)))
+        day += timedelta(days=1)
+
+    result: Dict[str, tuple[List[str], Optional[Dict[str, str]]]] = {}
+    now_local = datetime.now(_CLINIC_TZ)
+    lead_cutoff = now_local.timestamp() + _LEAD_SECONDS
+    for i in range(0, len(plans), _FREEBUSY_MAX_DAYS):
+        chunk = plans[i:i + _FREEBUSY_MAX_DAYS]
+        spans = [(earliest, latest) for _d, _s, _l, earliest, latest in chunk if earliest and latest]
+        busy: tuple[List[int], List[int]] = ([], [])
+        error = None
+        if spans:
+            busy_list, error = _query_busy(doctor, min(s[0] for s in spans), max(s[1] for s in spans))
+            busy = _busy_intervals(busy_list)
+        for day, slots, labels, earliest, latest in chunk:
+            ds = day.date().isoformat()
+            if not earliest or not latest:
+                result[ds] = ([], {"code": "no_schedule", "warning": "No clinic hours for this day"})
+                continue
+            if error:
+                result[ds] = ([], error)
+                continue
+            is_today = day.date() == now_local.date()
+            free_slots: List[str] = []
+            for (s_start, s_end), label in zip(slots, labels):
+                if is_today and s_start < lead_cutoff:
+                    continue
+                if not _overlaps(s_start, s_end, busy):
+                    free_slots.append(label)
+            if not free_slots:
+                # Distinguish cause (no future slots vs fully booked)
+                any_future_candidates = any((not is_today or (s_start >= lead_cutoff)) for s_start, _s_end in slots)
+                code = "no_future_slots" if not any_future_candidates else "fully_booked"
+                result[ds] = ([], {"code": code, "warning": "No available slots for the selected day"})
+            else:
+                result[ds] = (free_slots, None)
+    return result
+
+
+def _compute_free_slots_for_date(doctor: Dict[str, Any], date: str, slot_minutes: int) -> tuple[List[str], Optional[Dict[str, str]]]:
+    try:
+        day_dt = datetime.fromisoformat(date)
+    except Exception:
+        return [], {"code": "invalid_date", "warning": "Invalid date format"}
+    return _compute_free_slots_for_range(doctor, day_dt, day_dt, slot_minutes)[day_dt.date().isoformat()]
 
 
 def _within_schedule(doctor: Dict[str, Any], start_local: datetime, end_local: datetime) -> bool:
     schedule = doctor.get("weekly_schedule", {})
     day_name = start_local.strftime("%a")
-    windows = schedule.get(day_name, [])
-    for win in windows:
-        try:
-            start_s, end_s = win.split("-")
-            w_start = _localize(datetime.combine(start_local.date(), _parse_time(start_s)))
-            w_end = _localize(datetime.combine(start_local.date(), _parse_time(end_s)))
-        except Exception:
-            continue
-        if start_local >= w_start and end_local <= w_end:
+    windows = tuple(schedule.get(day_name, []))
+    for w_start, w_end in _window_offsets(windows):
+        if start_local >= _wall_clock(start_local, w_start) and end_local <= _wall_clock(start_local, w_end):
             return True
     return False
 
 
+def _is_schedule_slot(doctor: Dict[str, Any], start_local: datetime, slot_minutes: int) -> bool:
+    """True when start_local begins one of the day's slot_minutes-sized slots, as availability lists them."""
+    if start_local.second or start_local.microsecond:
+        return False
+    windows = tuple(doctor.get("weekly_schedule", {}).get(start_local.strftime("%a"), []))
+    offset = start_local.hour * 60 + start_local.minute
+    return (offset, offset + slot_minutes) in _slot_offsets(windows, slot_minutes)
+
+
 def _slot_conflicts_with_calendar(doctor: Dict[str, Any], start_local: datetime, end_local: datetime) -> bool:
     try:
         service = _google_service()
@@ -414,7 +711,10 @@ def _slot_conflicts_with_calendar(doctor: Dict[str, Any], start_local: datetime,
         print(f"[freebusy-preflight] ERROR: {e}")
         # If we cannot check, be conservative and say it conflicts to avoid double bookings
         return True
-    return _overlaps(start_local, end_local, busy_list)
+    return _overlaps(int(start_local.timestamp()), int(end_local.timestamp()), _busy_intervals(busy_list))
+
+
+_EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
 
 
 @app.tool()
@@ -429,8 +729,8 @@ def appointment_book_tool(
     patient_sex: Optional[str] = None,
     visit_mode: Optional[str] = None,
     condition: Optional[str] = None,
-    send_invitations: Optional[bool] = False,
-    create_meet: Optional[bool] = False,
+    send_invitations: bool = False,
+    create_meet: bool = False,
 ) -> Dict[str, Any]:
     """
     Book an appointment in the doctor's Google Calendar.
@@ -449,13 +749,11 @@ def appointment_book_tool(
         return {"error": "End time must be after start time."}
 
     # Basic email validation
-    if not isinstance(patient_email, str) or "@" not in patient_email or "." not in patient_email.split("@")[-1]:
+    if not isinstance(patient_email, str) or not _EMAIL_RE.match(patient_email):
         return {"error": "Invalid patient_email."}
 
     # Reject booking inside the lead window
-    now_local = datetime.now(pytz.timezone(DEFAULT_TZ))
-    lead_cutoff = now_local + timedelta(minutes=MIN_LEAD_MINUTES)
-    if start_local < lead_cutoff:
+    if start_local.timestamp() - _epoch_now() < _LEAD_SECONDS:
         return {"error": f"Appointments must be booked at least {MIN_LEAD_MINUTES} minutes in advance."}
 
     # Enforce schedule hours
@@ -466,16 +764,16 @@ def appointment_book_tool(
     if _slot_conflicts_with_calendar(doctor, start_local, end_local):
         return {"error": "Requested time is no longer available. Please pick another slot."}
 
-    # Guard: requested start must match an availability_tool slot for that day
-    try:
-        slot_minutes = int((end_local - start_local).total_seconds() // 60)
-        slots_for_day, _meta = _compute_free_slots_for_date(doctor, start_local.date().isoformat(), slot_minutes)
-        requested_hm = start_local.strftime("%H:%M")
-        if requested_hm not in slots_for_day:
-            return {"error": "Requested time is not an available slot for this doctor/day. Please pick a listed slot from availability."}
-    except Exception:
-        # If guard check fails unexpectedly, continue; calendar conflict check above still protects double-booking
-        pass
+    # Guard: requested start must match an availability_tool slot for that day. Hours, lead time and
+    # calendar conflicts are checked above, so only grid alignment is left; no second freebusy query.
+    slot_minutes = int((end_local - start_local).total_seconds() // 60)
+    if not _is_schedule_slot(doctor, start_local, slot_minutes):
+        return {"error": "Requested time is not an available slot for this doctor/day. Please pick a listed slot from availability."}
+
+    vm = (visit_mode or "").lower().strip()
+    fees = doctor.get("fees", {}) or {}
+    fee_str = f"PKR {fees.get('online_pkr') if vm == 'online' else fees.get('inperson_pkr')}"
+    mode_label = "Online (Google Meet)" if vm == "online" else "In-person"
 
     summary = f"Consultation: {doctor.get('name')} ↔ {patient_name}"
     description_lines = [
@@ -509,7 +807,6 @@ def appointment_book_tool(
         ]
         params["sendUpdates"] = "all"
 
-    vm = (visit_mode or "").lower().strip()
     if vm == "online" and create_meet:
         event["conferenceData"] = {
             "createRequest": {
@@ -546,69 +843,56 @@ def appointment_book_tool(
         else:
             return {"error": f"Google Calendar insert error: {e}"}
 
+    _remember_event(doctor.get("calendar_id"), created)
+
     # Try to send clinic confirmation email (best-effort)
-    fee_online = (doctor.get("fees", {}) or {}).get("online_pkr")
-    fee_inperson = (doctor.get("fees", {}) or {}).get("inperson_pkr")
-    fee_str = f"PKR {fee_online if vm=='online' else fee_inperson}"
     human_date = start_local.strftime('%a, %d %b %Y')
     human_time = f"{start_local.strftime('%H:%M')} - {end_local.strftime('%H:%M')} ({DEFAULT_TZ})"
     specialization = doctor.get('specialization') or "General"
     clinic_line = doctor.get('location') or "Unity Care Clinic, Karachi"
     meet_link = created.get('hangoutLink') or (created.get('conferenceData', {}) or {}).get('entryPoints', [{}])[0].get('uri') if isinstance(created.get('conferenceData'), dict) else None
-    mode_label = "Online (Google Meet)" if vm == "online" else "In-person"
+    meet_line = f"Google Meet: {meet_link}\n" if vm == "online" and meet_link else ""
+    add_link = _google_add_to_calendar_link(summary, start_local, end_local, details="Consultation scheduled via Unity Care Clinic.", location=doctor.get("location") if vm == "inperson" else None)
     # Patient email
     patient_subject = "Appointment Confirmation – Unity Care Clinic"
-    patient_lines = [
-        f"Dear {patient_name},\n\n",
-        f"Your appointment to consult for {condition or 'unspecified'} has been scheduled. Please find the details below:\n\n",
-        f"Doctor: {doctor.get('name')}\n",
-        f"Specialization: {specialization}\n",
-        f"Date: {human_date}\n",
-        f"Time: {human_time}\n",
-        f"Mode: {mode_label}\n",
-        f"Fee: {fee_str}\n",
-        f"Clinic: {clinic_line}\n",
-    ]
-    if vm == "online" and meet_link:
-        patient_lines.append(f"Google Meet: {meet_link}\n")
-    add_link = _google_add_to_calendar_link(summary, start_local, end_local, details="Consultation scheduled via Unity Care Clinic.", location=doctor.get("location") if vm == "inperson" else None)
-    patient_lines.extend([
-        "\nPlease join 15 minutes early. A calendar invite is attached; kindly add it to your calendar and join on time.\n",
-        f"Add to Google Calendar: {add_link}\n\n",
-        "Thank you,\n",
-        "Unity Care Clinic",
-    ])
-    patient_body = "".join(patient_lines)
+    patient_body = (
+        f"Dear {patient_name},\n\n"
+        f"Your appointment to consult for {condition or 'unspecified'} has been scheduled. Please find the details below:\n\n"
+        f"Doctor: {doctor.get('name')}\n"
+        f"Specialization: {specialization}\n"
+        f"Date: {human_date}\n"
+        f"Time: {human_time}\n"
+        f"Mode: {mode_label}\n"
+        f"Fee: {fee_str}\n"
+        f"Clinic: {clinic_line}\n"
+        f"{meet_line}"
+        "\nPlease join 15 minutes early. A calendar invite is attached; kindly add it to your calendar and join on time.\n"
+        f"Add to Google Calendar: {add_link}\n\n"
+        "Thank you,\n"
+        "Unity Care Clinic"
+    )
 
     # Doctor email
     doctor_subject = "New Appointment Scheduled – Unity Care Clinic"
-    doctor_lines = [
-        f"Dear {doctor.get('name')},\n\n",
-        "A new appointment has been booked for a patient consultation. Details are as follows:\n\n",
-        f"Patient: {patient_name}\n",
-    ]
-    if patient_phone:
-        doctor_lines.append(f"Patient phone: {patient_phone}\n")
-    if patient_age is not None:
-        doctor_lines.append(f"Patient age: {patient_age}\n")
-    if patient_sex:
-        doctor_lines.append(f"Patient sex: {patient_sex}\n")
-    doctor_lines.extend([
-        f"Condition: {condition or 'Unspecified'}\n",
-        f"Date: {human_date}\n",
-        f"Time: {human_time}\n",
-        f"Mode: {mode_label}\n",
-        f"Fee: {fee_str}\n",
-        f"Clinic: {clinic_line}\n",
-    ])
-    if vm == "online" and meet_link:
-        doctor_lines.append(f"Google Meet: {meet_link}\n")
-    doctor_lines.extend([
-        "\nPlease be available on time. A calendar event is attached; kindly add it to your calendar.\n\n",
-        "Thank you,\n",
-        "Unity Care Clinic",
-    ])
-    doctor_body = "".join(doctor_lines)
+    phone_line = f"Patient phone: {patient_phone}\n" if patient_phone else ""
+    age_line = f"Patient age: {patient_age}\n" if patient_age is not None else ""
+    sex_line = f"Patient sex: {patient_sex}\n" if patient_sex else ""
+    doctor_body = (
+        f"Dear {doctor.get('name')},\n\n"
+        "A new appointment has been booked for a patient consultation. Details are as follows:\n\n"
+        f"Patient: {patient_name}\n"
+        f"{phone_line}{age_line}{sex_line}"
+        f"Condition: {condition or 'Unspecified'}\n"
+        f"Date: {human_date}\n"
+        f"Time: {human_time}\n"
+        f"Mode: {mode_label}\n"
+        f"Fee: {fee_str}\n"
+        f"Clinic: {clinic_line}\n"
+        f"{meet_line}"
+        "\nPlease be available on time. A calendar event is attached; kindly add it to your calendar.\n\n"
+        "Thank you,\n"
+        "Unity Care Clinic"
+    )
 
     ics = _build_ics(
         summary=summary,
@@ -620,14 +904,13 @@ def appointment_book_tool(
         attendee_emails=[patient_email, doctor.get("email")],
         uid=created.get("id"),
     )
-    # Send to patient
-    smtp_ok1, smtp_err1 = _send_plain_email([patient_email], patient_subject, patient_body, ics_content=ics)
-    # Send to doctor (if email available)
-    smtp_ok2, smtp_err2 = (True, None)
+    # Send to patient, then doctor (if email available), over one SMTP session
+    outgoing = [([patient_email], patient_subject, patient_body, ics)]
     if doctor.get("email"):
-        smtp_ok2, smtp_err2 = _send_plain_email([doctor.get("email")], doctor_subject, doctor_body, ics_content=ics)
-    smtp_ok = smtp_ok1 and smtp_ok2
-    smtp_err = smtp_err1 or smtp_err2
+        outgoing.append(([doctor.get("email")], doctor_subject, doctor_body, ics))
+    sent = _send_plain_email_many(outgoing)
+    smtp_ok = all(ok for ok, _err in sent)
+    smtp_err = next((err for _ok, err in sent if err), None)
 
     return {
         "message": "Appointment booked successfully." + (" Google invites sent." if send_invitations else ""),
@@ -654,6 +937,17 @@ def _google_add_to_calendar_link(summary: str, start_local: datetime, end_local:
     return "https://calendar.google.com/calendar/render?" + urlencode(params)
 
 
+_ICS_HEADER = (
+    "BEGIN:VCALENDAR\r\n"
+    "PRODID:-//Unity Care Clinic//MCP//EN\r\n"
+    "VERSION:2.0\r\n"
+    "CALSCALE:GREGORIAN\r\n"
+    "METHOD:REQUEST\r\n"
+    "BEGIN:VEVENT\r\n"
+)
+_ICS_FOOTER = "END:VEVENT\r\nEND:VCALENDAR\r\n"
+
+
 def _build_ics(
     summary: str,
     start_local: datetime,
@@ -669,35 +963,26 @@ def _build_ics(
     dtstamp = datetime.now(pytz.UTC).strftime("%Y%m%dT%H%M%SZ")
     uid_val = uid or f"{uuid4()}@unity-care"
     desc = (description or "").replace("\n", "\\n")
-    lines = [
-        "BEGIN:VCALENDAR",
-        "PRODID:-//Unity Care Clinic//MCP//EN",
-        "VERSION:2.0",
-        "CALSCALE:GREGORIAN",
-        "METHOD:REQUEST",
-        "BEGIN:VEVENT",
-        f"UID:{uid_val}",
-        f"DTSTAMP:{dtstamp}",
-        f"DTSTART:{start_utc}",
-        f"DTEND:{end_utc}",
-        f"SUMMARY:{summary}",
-        f"DESCRIPTION:{desc}",
-    ]
-    if location:
-        lines.append(f"LOCATION:{location}")
-    if organizer_email:
-        lines.append(f"ORGANIZER;CN=Unity Care Clinic:MAILTO:{organizer_email}")
-    for e in (attendee_emails or []):
-        lines.append(f"ATTENDEE;CN={e};RSVP=FALSE:MAILTO:{e}")
-    lines.extend(["END:VEVENT", "END:VCALENDAR"])
-    return "\r\n".join(lines) + "\r\n"
+    location_line = f"LOCATION:{location}\r\n" if location else ""
+    organizer_line = f"ORGANIZER;CN=Unity Care Clinic:MAILTO:{organizer_email}\r\n" if organizer_email else ""
+    attendee_lines = "".join(f"ATTENDEE;CN={e};RSVP=FALSE:MAILTO:{e}\r\n" for e in (attendee_emails or []))
+    return (
+        f"{_ICS_HEADER}"
+        f"UID:{uid_val}\r\n"
+        f"DTSTAMP:{dtstamp}\r\n"
+        f"DTSTART:{start_utc}\r\n"
+        f"DTEND:{end_utc}\r\n"
+        f"SUMMARY:{summary}\r\n"
+        f"DESCRIPTION:{desc}\r\n"
+        f"{location_line}{organizer_line}{attendee_lines}"
+        f"{_ICS_FOOTER}"
+    )
 
 
 @app.tool()
 def now_tool() -> Dict[str, Any]:
     """Return the current date/time in clinic timezone and UTC."""
-    tz = pytz.timezone(DEFAULT_TZ)
-    now_local = datetime.now(tz)
+    now_local = datetime.now(_CLINIC_TZ)
     now_utc = datetime.now(pytz.UTC)
     return {
         "timezone": DEFAULT_TZ,
@@ -711,21 +996,74 @@ def now_tool() -> Dict[str, Any]:
     }
 
 
-def _event_contains_patient(ev: Dict[str, Any], patient_email: str) -> bool:
-    if not patient_email:
+# Events recently fetched or listed, keyed by (calendar_id, event_id). Cancel and reschedule read them for
+# the ownership check, which usually follows a listing within seconds; writes evict the entry.
+EVENT_CACHE_TTL_SECONDS = int(os.getenv("EVENT_CACHE_TTL_SECONDS", "30"))
+_EVENT_CACHE: TTLCache = TTLCache(maxsize=512, ttl=EVENT_CACHE_TTL_SECONDS)
+_EVENT_CACHE_LOCK = threading.Lock()
+
+
+def _remember_event(calendar_id: str, ev: Dict[str, Any]) -> None:
+    with _EVENT_CACHE_LOCK:
+        _EVENT_CACHE[(calendar_id, ev.get("id"))] = ev
+
+
+def _forget_event(calendar_id: str, event_id: str) -> None:
+    with _EVENT_CACHE_LOCK:
+        _EVENT_CACHE.pop((calendar_id, event_id), None)
+
+
+def _fetch_event(calendar_id: str, event_id: str) -> Dict[str, Any]:
+    with _EVENT_CACHE_LOCK:
+        ev = _EVENT_CACHE.get((calendar_id, event_id))
+    if ev is None:
+        ev = _google_service().events().get(calendarId=calendar_id, eventId=event_id).execute()
+        _remember_event(calendar_id, ev)
+    # Callers may edit the event they get back; keep the cached copy intact
+    return dict(ev)
+
+
+def _event_contains_patient(ev: Dict[str, Any], pe: str) -> bool:
+    """pe is the patient email, already lower-cased and stripped by the caller."""
+    if not pe:
         return False
-    pe = patient_email.lower().strip()
-    # Check attendees
-    for a in ev.get("attendees", []) or []:
+    # Check attendees; when the event has any, they are authoritative
+    attendees = ev.get("attendees") or []
+    for a in attendees:
         try:
-            email = str(a.get("email", "")).lower().strip()
-            if email == pe:
+            if str(a.get("email", "")).lower().strip() == pe:
                 return True
         except Exception:
             continue
-    # Fallback: check description lines
-    desc = (ev.get("description") or "").lower()
-    return pe in desc
+    if attendees:
+        return False
+    # Fallback for events booked without invitations: the patient is recorded in the description
+    return pe in (ev.get("description") or "").lower()
+
+
+# Google caps a Calendar batch request at 50 calls
+_CALENDAR_BATCH_LIMIT = 50
+
+
+def _list_calendar_events(calendars: List[Dict[str, Any]], time_min: str, time_max: str) -> List[Optional[List[Dict[str, Any]]]]:
+    """events.list for each calendar, sent as one batch HTTP request. None marks a calendar that failed."""
+    service = _google_service()
+    results: List[Optional[List[Dict[str, Any]]]] = [None] * len(calendars)
+
+    def _collect(request_id: str, response: Dict[str, Any], exception: Optional[Exception]) -> None:
+        if exception is not None:
+            print(f"[list_appointments] ERROR: {exception}")
+            return
+        results[int(request_id)] = response.get("items", [])
+
+    batch = service.new_batch_http_request(callback=_collect)
+    for i, c in enumerate(calendars):
+        batch.add(
+            service.events().list(calendarId=c["id"], timeMin=time_min, timeMax=time_max, singleEvents=True, orderBy="startTime"),
+            request_id=str(i),
+        )
+    batch.execute()
+    return results
 
 
 @app.tool()
@@ -741,7 +1079,7 @@ def list_appointments_tool(
     if not patient_email:
         return {"error": "patient_email is required"}
     try:
-        service = _google_service()
+        _google_service()
     except Exception as e:
         return {"error": str(e)}
     calendars: List[Dict[str, Any]] = []
@@ -751,35 +1089,40 @@ def list_appointments_tool(
             return {"error": f"Unknown doctor_id: {doctor_id}"}
         calendars.append({"id": d.get("calendar_id"), "doctor": d})
     else:
-        for d in DB.get("doctors", []):
+        for d in _db().get("doctors", []):
             calendars.append({"id": d.get("calendar_id"), "doctor": d})
-    now_local = datetime.now(pytz.timezone(DEFAULT_TZ))
+    now_local = datetime.now(_CLINIC_TZ)
     time_min = now_local.isoformat()
     time_max = (now_local + timedelta(days=window_days)).isoformat()
+    pe = patient_email.lower().strip()
     results: List[Dict[str, Any]] = []
-    for c in calendars:
+    # Up to _CALENDAR_BATCH_LIMIT calendars are read per batch request
+    for i in range(0, len(calendars), _CALENDAR_BATCH_LIMIT):
+        chunk = calendars[i:i + _CALENDAR_BATCH_LIMIT]
         try:
-            events = service.events().list(
-                calendarId=c["id"], timeMin=time_min, timeMax=time_max, singleEvents=True, orderBy="startTime"
-            ).execute().get("items", [])
+            per_calendar = _list_calendar_events(chunk, time_min, time_max)
         except Exception as e:
             print(f"[list_appointments] ERROR: {e}")
             continue
-        for ev in events:
-            if not _event_contains_patient(ev, patient_email):
+        for c, events in zip(chunk, per_calendar):
+            if events is None:
                 continue
-            start_dt = (ev.get("start") or {}).get("dateTime") or (ev.get("start") or {}).get("date")
-            end_dt = (ev.get("end") or {}).get("dateTime") or (ev.get("end") or {}).get("date")
-            results.append({
-                "doctor_id": c["doctor"].get("doctor_id"),
-                "doctor_name": c["doctor"].get("name"),
-                "event_id": ev.get("id"),
-                "htmlLink": ev.get("htmlLink"),
-                "start": start_dt,
-                "end": end_dt,
-                "summary": ev.get("summary"),
-                # Do not leak attendees list
-            })
+            for ev in events:
+                if not _event_contains_patient(ev, pe):
+                    continue
+                _remember_event(c["id"], ev)
+                start_dt = (ev.get("start") or {}).get("dateTime") or (ev.get("start") or {}).get("date")
+                end_dt = (ev.get("end") or {}).get("dateTime") or (ev.get("end") or {}).get("date")
+                results.append({
+                    "doctor_id": c["doctor"].get("doctor_id"),
+                    "doctor_name": c["doctor"].get("name"),
+                    "event_id": ev.get("id"),
+                    "htmlLink": ev.get("htmlLink"),
+                    "start": start_dt,
+                    "end": end_dt,
+                    "summary": ev.get("summary"),
+                    # Do not leak attendees list
+                })
     return {"events": results}
 
 
@@ -796,8 +1139,8 @@ def cancel_appointment_tool(
         return {"error": f"Unknown doctor_id: {doctor_id}"}
     try:
         service = _google_service()
-        ev = service.events().get(calendarId=d.get("calendar_id"), eventId=event_id).execute()
-        if not _event_contains_patient(ev, patient_email):
+        ev = _fetch_event(d.get("calendar_id"), event_id)
+        if not _event_contains_patient(ev, (patient_email or "").lower().strip()):
             return {"error": "Unauthorized: event does not belong to the requesting patient."}
         
         # Extract appointment details for email
@@ -809,8 +1152,8 @@ def cancel_appointment_tool(
         # Parse dates for email formatting
         try:
             if "T" in start_dt_str:
-                start_local = datetime.fromisoformat(start_dt_str.replace("Z", "+00:00")).astimezone(pytz.timezone(DEFAULT_TZ))
-                end_local = datetime.fromisoformat(end_dt_str.replace("Z", "+00:00")).astimezone(pytz.timezone(DEFAULT_TZ))
+                start_local = datetime.fromisoformat(start_dt_str.replace("Z", "+00:00")).astimezone(_CLINIC_TZ)
+                end_local = datetime.fromisoformat(end_dt_str.replace("Z", "+00:00")).astimezone(_CLINIC_TZ)
                 human_date = start_local.strftime('%a, %d %b %Y')
                 human_time = f"{start_local.strftime('%H:%M')} - {end_local.strftime('%H:%M')} ({DEFAULT_TZ})"
             else:
@@ -830,6 +1173,7 @@ def cancel_appointment_tool(
         params = {}
         if notify_attendees:
             params["sendUpdates"] = "all"
+        _forget_event(d.get("calendar_id"), event_id)
         service.events().delete(calendarId=d.get("calendar_id"), eventId=event_id, **params).execute()
         
         # Send cancellation emails
@@ -866,13 +1210,13 @@ Thank you,
 Unity Care Clinic"""
         
         # Send emails (best-effort)
-        smtp_ok1, smtp_err1 = _send_plain_email([patient_email], patient_subject, patient_body)
-        smtp_ok2, smtp_err2 = (True, None)
+        outgoing = [([patient_email], patient_subject, patient_body, None)]
         if d.get("email"):
-            smtp_ok2, smtp_err2 = _send_plain_email([d.get("email")], doctor_subject, doctor_body)
+            outgoing.append(([d.get("email")], doctor_subject, doctor_body, None))
+        sent = _send_plain_email_many(outgoing)
         
-        smtp_ok = smtp_ok1 and smtp_ok2
-        smtp_err = smtp_err1 or smtp_err2
+        smtp_ok = all(ok for ok, _err in sent)
+        smtp_err = next((err for _ok, err in sent if err), None)
         
         return {
             "ok": True,
@@ -901,18 +1245,20 @@ def reschedule_tool(
         end_local = _localize(datetime.fromisoformat(new_end))
     except Exception:
         return {"error": "Invalid new_start/new_end format. Use YYYY-MM-DDTHH:MM"}
-    now_local = datetime.now(pytz.timezone(DEFAULT_TZ))
-    lead_cutoff = now_local + timedelta(minutes=MIN_LEAD_MINUTES)
-    if start_local < lead_cutoff:
+    if start_local.timestamp() - _epoch_now() < _LEAD_SECONDS:
         return {"error": f"Appointments must be rescheduled at least {MIN_LEAD_MINUTES} minutes in advance."}
     if not _within_schedule(d, start_local, end_local):
         return {"error": "Selected time is outside clinic hours for this doctor."}
+    # The event lookup and the conflict check are independent round-trips; overlap them.
+    # Cheap local validation above runs first so rejected requests never start the lookup.
+    ev_future = _CALENDAR_POOL.submit(_fetch_event, d.get("calendar_id"), event_id)
     if _slot_conflicts_with_calendar(d, start_local, end_local):
+        ev_future.cancel()
         return {"error": "Requested time is no longer available. Please pick another slot."}
     try:
         service = _google_service()
-        ev = service.events().get(calendarId=d.get("calendar_id"), eventId=event_id).execute()
-        if not _event_contains_patient(ev, patient_email):
+        ev = ev_future.result()
+        if not _event_contains_patient(ev, (patient_email or "").lower().strip()):
             return {"error": "Unauthorized: event does not belong to the requesting patient."}
         
         # Extract old appointment details
@@ -923,8 +1269,8 @@ def reschedule_tool(
         # Parse old dates for email
         try:
             if "T" in old_start_dt_str:
-                old_start = datetime.fromisoformat(old_start_dt_str.replace("Z", "+00:00")).astimezone(pytz.timezone(DEFAULT_TZ))
-                old_end = datetime.fromisoformat(old_end_dt_str.replace("Z", "+00:00")).astimezone(pytz.timezone(DEFAULT_TZ))
+                old_start = datetime.fromisoformat(old_start_dt_str.replace("Z", "+00:00")).astimezone(_CLINIC_TZ)
+                old_end = datetime.fromisoformat(old_end_dt_str.replace("Z", "+00:00")).astimezone(_CLINIC_TZ)
                 old_date = old_start.strftime('%a, %d %b %Y')
                 old_time = f"{old_start.strftime('%H:%M')} - {old_end.strftime('%H:%M')}"
             else:
@@ -941,10 +1287,16 @@ def reschedule_tool(
             if len(parts) > 1:
                 patient_name = parts[1].strip()
         
-        ev["start"] = {"dateTime": start_local.isoformat(), "timeZone": DEFAULT_TZ}
-        ev["end"] = {"dateTime": end_local.isoformat(), "timeZone": DEFAULT_TZ}
-        updated = service.events().update(
-            calendarId=d.get("calendar_id"), eventId=event_id, body=ev, sendUpdates="all"
+        # Patch only the times instead of re-sending the whole event body
+        _forget_event(d.get("calendar_id"), event_id)
+        updated = service.events().patch(
+            calendarId=d.get("calendar_id"),
+            eventId=event_id,
+            body={
+                "start": {"dateTime": start_local.isoformat(), "timeZone": DEFAULT_TZ},
+                "end": {"dateTime": end_local.isoformat(), "timeZone": DEFAULT_TZ},
+            },
+            sendUpdates="all",
         ).execute()
         
         # Format new dates for email
@@ -993,13 +1345,13 @@ Thank you,
 Unity Care Clinic"""
         
         # Send emails (best-effort)
-        smtp_ok1, smtp_err1 = _send_plain_email([patient_email], patient_subject, patient_body)
-        smtp_ok2, smtp_err2 = (True, None)
+        outgoing = [([patient_email], patient_subject, patient_body, None)]
         if d.get("email"):
-            smtp_ok2, smtp_err2 = _send_plain_email([d.get("email")], doctor_subject, doctor_body)
+            outgoing.append(([d.get("email")], doctor_subject, doctor_body, None))
+        sent = _send_plain_email_many(outgoing)
         
-        smtp_ok = smtp_ok1 and smtp_ok2
-        smtp_err = smtp_err1 or smtp_err2
+        smtp_ok = all(ok for ok, _err in sent)
+        smtp_err = next((err for _ok, err in sent if err), None)
         
         return {
             "ok": True,